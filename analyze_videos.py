@@ -0,0 +1,176 @@
+"""Classifies video archives offline, as fast as the hardware allows.
+
+    python analyze_videos.py /footage/night --workers 2 --clip-size 32 --output night.csv
+
+Files and directories (searched recursively) are split across worker
+processes, each loading the model once. Frames are classified without
+pacing or rendering and every clip becomes one row of the timeline, the
+format follows the output extension: .json, .csv or .parquet.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import time
+
+import cv2
+
+from frame_buffer import BLOCK
+from video_capture import VideoCapture
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.webm', '.mpg', '.mpeg', '.m4v', '.wmv', '.flv')
+OUTPUT_FORMATS = ('json', 'csv', 'parquet')
+TIMELINE_FIELDS = ('video', 'clip', 'start_frame', 'end_frame', 'start_time', 'end_time', 'label', 'score',
+                   'violence_score', 'skipped')
+
+#one model per worker process, loaded by init_worker
+worker_model = None
+
+
+def find_videos(paths):
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in sorted(os.walk(path)):
+                videos += [os.path.join(root, name) for name in sorted(names)
+                           if name.lower().endswith(VIDEO_EXTENSIONS)]
+        else:
+            videos.append(path)
+    return videos
+
+
+def init_worker(model_options):
+    global worker_model
+    from model.model import ViolenceModel
+    worker_model = ViolenceModel(**model_options)
+
+
+def analyze_video(job):
+    """Classifies one video, returns its summary and clip rows."""
+    video, config = job
+    model = worker_model
+    model.update(config)
+
+    probe = cv2.VideoCapture(video)
+    if not probe.isOpened():
+        return {'video': video, 'error': 'cannot open video'}, []
+    fps = probe.get(cv2.CAP_PROP_FPS) or 30
+    probe.release()
+
+    stride = model.stride
+    capture = VideoCapture(video_src=video, clip_size=model.clip_size, buffer_clips=4, overflow=BLOCK, stride=stride,
+                           measure_motion=model.motion_threshold > 0)
+    capture.start_capture_thread()
+
+    rows = []
+    started = time.perf_counter()
+    while capture.isFlowing():
+        clip = capture.read_clip(model.clip_size, model.hop)
+        if clip is None:
+            continue
+        overlap, available = capture.new_frames()
+        first = capture.clip_trace().first_index - overlap
+        label = model.classify(clip, overlap, capture.channel_order, motion=capture.clip_motion())
+
+        #positions in source frames, strided clips span clip_size*stride of them
+        start_frame = first * stride
+        end_frame = (first + available - 1) * stride
+        rows.append({
+            'video': video,
+            'clip': len(rows),
+            'start_frame': start_frame,
+            'end_frame': end_frame,
+            'start_time': round(start_frame / fps, 3),
+            'end_time': round((end_frame + 1) / fps, 3),
+            'label': label['label'],
+            'score': float(label['score']),
+            'violence_score': round(float(model.prediction_buffer[-1][1]) * 100, 2),
+            'skipped': label['skipped'],
+        })
+    capture.stop()
+    seconds = time.perf_counter() - started
+
+    frames = rows[-1]['end_frame'] + 1 if rows else 0
+    summary = {'video': video, 'fps': fps, 'frames': frames, 'clips': len(rows),
+               'processing_seconds': round(seconds, 3), 'speedup': round(frames / fps / seconds, 2) if seconds else 0}
+    return summary, rows
+
+
+def write_timeline(path, output_format, summaries, rows):
+    if output_format == 'json':
+        clips = {}
+        for row in rows:
+            clips.setdefault(row['video'], []).append({key: value for key, value in row.items() if key != 'video'})
+        videos = [dict(summary, timeline=clips.get(summary['video'], [])) for summary in summaries]
+        with open(path, 'w') as output:
+            json.dump({'videos': videos}, output, indent=2)
+    elif output_format == 'csv':
+        with open(path, 'w', newline='') as output:
+            writer = csv.DictWriter(output, fieldnames=TIMELINE_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('parquet output needs pyarrow (pip install pyarrow)')
+        table = pyarrow.table({field: [row[field] for row in rows] for field in TIMELINE_FIELDS})
+        pyarrow.parquet.write_table(table, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='+', help='video files or directories')
+    parser.add_argument('--output', default='timeline.json')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default=None, help='defaults to the output extension')
+    parser.add_argument('--workers', type=int, default=1, help='processes, each holds a copy of the model')
+    parser.add_argument('--clip-size', type=int, default=32)
+    parser.add_argument('--hop', type=int, default=None)
+    parser.add_argument('--stride', type=int, default=1)
+    parser.add_argument('--memory', type=int, default=1)
+    parser.add_argument('--threshold', type=int, default=65)
+    parser.add_argument('--motion-threshold', type=float, default=0,
+                        help='clips with less motion are NonViolence without inference, 0 classifies every clip')
+    parser.add_argument('--backend', default='keras')
+    parser.add_argument('--model-path', default=None, help='model file of the tflite and onnx backends')
+    args = parser.parse_args()
+
+    output_format = args.format or os.path.splitext(args.output)[1].lstrip('.').lower()
+    if output_format not in OUTPUT_FORMATS:
+        parser.error('output format should be one of %s' % str(OUTPUT_FORMATS))
+
+    videos = find_videos(args.paths)
+    if not videos:
+        parser.error('no videos found')
+
+    from controller import ModelConfig
+    config = ModelConfig(clip_size=args.clip_size, memory=args.memory, threshold=args.threshold,
+                         hop=args.hop, stride=args.stride, motion_threshold=args.motion_threshold)
+    model_options = {'clip_size': args.clip_size, 'backend': args.backend}
+    if args.model_path:
+        model_options['model_path'] = args.model_path
+
+    summaries, rows = [], []
+    started = time.perf_counter()
+    #spawned workers never inherit an initialized TensorFlow runtime
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(args.workers, initializer=init_worker, initargs=(model_options,)) as pool:
+        for summary, video_rows in pool.imap_unordered(analyze_video, [(video, config) for video in videos]):
+            summaries.append(summary)
+            rows += video_rows
+            if 'error' in summary:
+                print('%s: %s' % (summary['video'], summary['error']))
+            else:
+                print('%s: %d clips, %.1fx real time' % (summary['video'], summary['clips'], summary['speedup']))
+
+    order = {video: i for i, video in enumerate(videos)}
+    summaries.sort(key=lambda summary: order[summary['video']])
+    rows.sort(key=lambda row: (order[row['video']], row['clip']))
+    write_timeline(args.output, output_format, summaries, rows)
+    print('%d videos in %.1fs, timeline written to %s' % (len(videos), time.perf_counter() - started, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,13 +2,14 @@ import time
 
 import gradio as gr
 
-from controller import Controller, ModelConfig, StartUpConfig
+from controller import ModelConfig, StartUpConfig
+from session_manager import SessionManager
 
-# Initialize the controller
-controller = Controller()
+# One pipeline per browser session, all on the same loaded model
+sessions = SessionManager()
 
 
-def start(video, clip_size, threshold, memory, input_format):
+def start(video, clip_size, threshold, memory, input_format, request: gr.Request):
     source = input_format
     if input_format == "Video Upload":
         source = video
@@ -23,7 +24,7 @@ def start(video, clip_size, threshold, memory, input_format):
         ),
     )
 
-    controller.start(config)
+    controller = sessions.start(request.session_hash, config)
 
     for frame, label in controller.frame_stream():
         yield (
@@ -38,16 +39,17 @@ def start(video, clip_size, threshold, memory, input_format):
         )
 
 
-def handle_webcam_stream(frame):
-    if not controller.video_capture:
+def handle_webcam_stream(frame, request: gr.Request):
+    controller = sessions.get(request.session_hash, create=False)
+    if not controller or not controller.video_capture:
         time.sleep(0.1)
         return gr.update(value=1)
 
     controller.trigger_capture(frame)
 
 
-def end_processing():
-    controller.end()
+def end_processing(request: gr.Request):
+    sessions.end(request.session_hash)
     return (
         gr.update(value=None),
         gr.update(value=None),
@@ -59,6 +61,10 @@ def end_processing():
     )
 
 
+def close_session(request: gr.Request):
+    sessions.remove(request.session_hash)
+
+
 def on_tab_select(event_data: gr.SelectData):
     selected_tab = event_data.value
     return selected_tab
@@ -206,6 +212,7 @@ with gr.Blocks(css=css) as demo:
                 delay_output,
                 capture_fps,
             ],
+            concurrency_limit=None,
         )
 
         end_button.click(
@@ -250,7 +257,7 @@ with gr.Blocks(css=css) as demo:
                 capture_fps,
             ],
             trigger_mode="once",
-            concurrency_limit=1,
+            concurrency_limit=None,
         )
         cam_stream.then(
             fn=end_processing,
@@ -266,6 +273,8 @@ with gr.Blocks(css=css) as demo:
             ],
             cancels=[processing_event],
         )
+        # free the session's pipeline when its browser tab closes
+        demo.unload(close_session)
         print("* Running on local URL:  http://127.0.0.1:7860")
         print("* Running on local URL:  http://localhost:7860")
 
@@ -0,0 +1,49 @@
+"""Per-call cost of `model.predict` against the compiled inference path.
+
+Run from the repository root:
+
+    python -m benchmarks.predict_overhead --clip-sizes 16 32 --calls 20
+"""
+import argparse
+import time
+
+import numpy as np
+
+from model.keras_backend import KerasBackend
+from model.model import labels
+
+
+def time_calls(fn, calls):
+    times = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return np.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clip-sizes', type=int, nargs='+', default=[16, 32, 64])
+    parser.add_argument('--calls', type=int, default=20)
+    parser.add_argument('--jit', action='store_true', help='XLA compile the traced function')
+    args = parser.parse_args()
+
+    frame_dims = (224, 224, 3)
+    # random weights, only the call path is measured
+    model = KerasBackend.loadModel(numberOfClasses=len(labels), inputFrames=None, frameDims=frame_dims,
+                                    rescaleInput=True)
+
+    print('clip_size  predict(ms)  compiled(ms)  overhead(ms)')
+    for clip_size in args.clip_sizes:
+        clip = KerasBackend.randomInput(clip_size, frame_dims, rescaleInput=True)
+        KerasBackend.warmUp(model, clip_size, frame_dims, rescaleInput=True)
+        predict = KerasBackend.compileModel(model, clip_size, frame_dims, rescaleInput=True, jitCompile=args.jit)
+
+        keras_ms = time_calls(lambda: model.predict(clip, batch_size=1, verbose=0), args.calls)
+        compiled_ms = time_calls(lambda: predict(clip), args.calls)
+        print('%9d  %11.1f  %12.1f  %12.1f' % (clip_size, keras_ms, compiled_ms, keras_ms - compiled_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,17 +2,32 @@ from model.model import ViolenceModel
 from video_capture import VideoCapture
 from output_pipe import OutputPipe
 from utils import PerformanceTimer
+from metrics import serve_metrics, bind_gauges, unbind_gauges, FPS, STREAMING_DELAY
+from tracing import LatencyTracer, CLASSIFY
+from pipeline import Pipeline, Stage
 import threading
 import cv2
-from pydantic import BaseModel
+from collections import deque
+from frame_buffer import BLOCK, DROP_OLDEST
+from pydantic import BaseModel, model_validator
+from typing import Optional
 import os
 
 class Controller():
 
 
-    def __init__(self):
+    def __init__(self, model = None, metrics_port = None, session = 'default'):
 
-        self.model = ViolenceModel(clip_size=32, memory=3, threshold=70)
+        # model: a ViolenceModel of this controller alone, usually a session of a shared one (see SessionManager)
+        self.model = model or ViolenceModel(clip_size=32, memory=3, threshold=70)
+
+        #per stage metrics in Prometheus text format on http://127.0.0.1:<metrics_port>/metrics, 0 disables
+        if metrics_port is None:
+            metrics_port = int(os.environ.get("METRICS_PORT", 9464))
+        self.metrics_server = serve_metrics(metrics_port) if metrics_port else None
+        # session: label of this controller's stream in the shared metrics
+        self.session = session
+        self.gauges = []
         self.output_pipe = None
         self.video_capture = None
 
@@ -21,7 +36,9 @@ class Controller():
         self.frame_rate = 0
 
         self.processing_thread = None
-        self.stop_flag = None
+        self.pipeline = None
+        self.input_buffers = deque([])
+        self.previous_buffer = None
 
 
 
@@ -32,18 +49,45 @@ class Controller():
 
         self.model.update(config.modelConfig)
 
-        self.output_pipe = OutputPipe()
-
         self.preformanceTimer = PerformanceTimer()
         self.streaming_delay = -1
         self.frame_rate = 0
 
-        self.video_capture = VideoCapture(video_src=config.source,trigger_mode=True)
+        #live sources drop frames when inference lags, files wait for it
+        overflow = config.overflow_policy or DROP_OLDEST
+        measure_motion = self.model.motion_threshold > 0
+        self.video_capture = VideoCapture(video_src=config.source,trigger_mode=True, clip_size=self.model.clip_size,
+                                          buffer_clips=config.buffer_clips, overflow=overflow,
+                                          stride=self.model.stride, measure_motion=measure_motion,
+                                          session=self.session)
         if not config.source == "Webcam Streaming":
-            self.video_capture = VideoCapture(video_src=config.source)
+            overflow = config.overflow_policy or BLOCK
+            self.video_capture = VideoCapture(video_src=config.source, clip_size=self.model.clip_size,
+                                              buffer_clips=config.buffer_clips, overflow=overflow,
+                                              stride=self.model.stride, measure_motion=measure_motion,
+                                              session=self.session)
             self.video_capture.start_capture_thread()
 
-        self.stop_flag = threading.Event()
+        #strided clips only hold every stride-th frame, play them back at the matching rate
+        self.output_pipe = OutputPipe(fps=30/self.model.stride, storage=config.output_storage,
+                                      max_bytes=config.output_max_mb << 20,
+                                      channel_order=self.video_capture.channel_order,
+                                      playout_percentile=config.playout_percentile,
+                                      tracer=LatencyTracer(config.trace_path, config.trace_sample_every),
+                                      session=self.session, block=overflow == BLOCK)
+        self.gauges = bind_gauges([
+            (FPS, ('processing', self.session), lambda: self.frame_rate),
+            (STREAMING_DELAY, (self.session,), lambda: max(self.streaming_delay, 0)),
+        ])
+
+        #capture+preprocess -> inference -> output, each stage overlaps the others and full queues hold back the one before
+        self.input_buffers = deque([])
+        self.previous_buffer = None
+        self.pipeline = Pipeline(self.capture_stage, [
+            Stage('inference', self.inference_stage, workers=config.inference_workers, queue_size=config.pipeline_depth),
+            Stage('output', self.output_stage, queue_size=config.pipeline_depth),
+        ], session=self.session)
+
         self.processing_thread = threading.Thread(target=self.processing_loop)
 
         self.processing_thread.daemon = True
@@ -54,35 +98,78 @@ class Controller():
     def processing_loop(self):
 
         self.preformanceTimer.setStartingTime()
-        while(self.video_capture.isFlowing() and not self.stop_flag.is_set()):
-
-            clip = self.video_capture.read_clip(self.model.clip_size)
-            label = self.model.classify(clip)
-
-            self.output_pipe.read_output(clip,label)
-
-            self.preformanceTimer.record()
-            self.frame_rate = self.preformanceTimer.getFramerate(self.model.clip_size)
-
-            #calculate required delay before streaming / depends on machine preformance
-            if(self.preformanceTimer.hasRecords(n=1)):# record n classifications before calculating delay
-                self.streaming_delay = self.preformanceTimer.calculateDelay(self.output_pipe.spf, self.model.clip_size)
-                # start streaming labeled frames
-                self.output_pipe.start_after_delay(self.streaming_delay)
-            #if video is shorter than n records just start
-            elif not self.video_capture.isFlowing():
-                self.output_pipe.start()
+        #returns once the input is drained or the pipeline is aborted
+        self.pipeline.start().join()
 
         self.output_pipe.end()
         self.video_capture.stop()
+        #nothing is processed anymore, the output pipe keeps reporting playback until it is done
+        unbind_gauges(self.gauges)
         self.delTmpVideo()
 
+    def capture_stage(self):
+        #the clip is a view into the capture ring, it is preprocessed and copied for output
+        #and then released before this returns
+        if not self.video_capture.isFlowing():
+            raise StopIteration
+        clip = self.video_capture.read_clip(self.model.clip_size, self.model.hop)
+        if clip is None:
+            return None
+        overlap, available = self.video_capture.new_frames()
+        trace = self.video_capture.clip_trace()
+        trace.enter(CLASSIFY)
+
+        #overlapping windows only output the frames they added
+        frames, nbytes = self.output_pipe.compact(clip[overlap:available])
+
+        #static clips skip preprocessing and inference, the next clip starts a fresh input buffer
+        if self.model.gate(self.video_capture.clip_motion()):
+            self.video_capture.release_clip()
+            self.previous_buffer = None
+            return [None, frames, nbytes, trace, None]
+
+        #input buffers come back from the output stage, frames shared with the last clip are copied from its buffer
+        input_buffer = self.input_buffers.popleft() if self.input_buffers else self.model.new_input_buffer()
+        cached = overlap if self.previous_buffer is not None else 0
+        processed_clip = self.model.preprocess(clip, cached, self.video_capture.channel_order,
+                                               out=input_buffer, previous=self.previous_buffer)
+        self.previous_buffer = processed_clip
+        #nothing reads the view anymore, a live ring can drop its oldest frames while this clip waits for inference
+        self.video_capture.release_clip()
+        return [processed_clip, frames, nbytes, trace, None]
+
+    def inference_stage(self, item):
+        if item[0] is not None:
+            item[4] = self.model.predict(item[0])
+        return item
+
+    def output_stage(self, item):
+        processed_clip, frames, nbytes, trace, prediction = item
+
+        #clips arrive in capture order, so the prediction memory sees them in order too
+        if processed_clip is None:
+            label = self.model.skip(len(frames))
+        else:
+            self.input_buffers.append(processed_clip)
+            label = self.model.decide(prediction, len(frames))
+        self.output_pipe.append(frames, nbytes, label, trace)
+
+        self.preformanceTimer.record()
+        self.frame_rate = self.preformanceTimer.getFramerate(self.model.hop*self.model.stride)
+
+        #playout delay adapts to how long clips take on this machine
+        clip_seconds = self.preformanceTimer.lastRecord if self.preformanceTimer.records else self.preformanceTimer.timeFromStarting()
+        self.output_pipe.observe(clip_seconds, len(frames))
+        self.streaming_delay = self.output_pipe.delay()
+
     def end(self):
-        if(self.stop_flag):
-            self.stop_flag.set()
+        if(self.pipeline):
+            self.pipeline.abort()
             self.output_pipe.terminate()
             self.video_capture.stop()
             self.processing_thread.join()
+        unbind_gauges(self.gauges)
+        self.gauges = []
         self.output_pipe = None
         self.video_capture = None
 
@@ -91,12 +178,14 @@ class Controller():
         self.frame_rate = 0
 
         self.processing_thread = None
-        self.stop_flag = None
+        self.pipeline = None
 
     def getModelConfig(self):
         return {
             "threshold":self.model.threshold,
             "clip_size":self.model.clip_size,
+            "hop":self.model.hop,
+            "stride":self.model.stride,
             "memory":self.model.memory
         }
 
@@ -128,7 +217,25 @@ class ModelConfig(BaseModel):
     clip_size:int
     memory:int
     threshold:int
+    hop:Optional[int] = None # frames between window starts, defaults to clip_size (no overlap)
+    stride:int = 1 # sample every stride-th source frame, a clip then covers clip_size*stride frames
+    motion_threshold:float = 0 # clips whose strongest frame motion is below it are NonViolence without inference (~0.005), 0 disables
+
+    @model_validator(mode='after')
+    def check_hop(self):
+        if self.hop is not None and not 0 < self.hop <= self.clip_size:
+            raise ValueError('hop should be between 1 and clip_size')
+        return self
 
 class StartUpConfig(BaseModel):
     source: str
     modelConfig: ModelConfig
+    buffer_clips: int = 4 # capture ring capacity in clips
+    overflow_policy: Optional[str] = None # drop_oldest, drop_newest or block
+    output_storage: str = "scaled" # raw, scaled (to 720p) or jpeg frames waiting for playback
+    output_max_mb: int = 1024 # memory budget of frames waiting for playback
+    playout_percentile: float = 95 # clip time percentile the playout buffer covers, lower favours latency
+    trace_path: Optional[str] = None # Chrome trace-event JSON of sampled frames, written when the stream ends
+    trace_sample_every: int = 100 # trace every n-th captured frame
+    inference_workers: int = 1 # clips in inference at once, more only help batching or thread-safe backends
+    pipeline_depth: int = 2 # clips queued in front of each processing stage
@@ -0,0 +1,41 @@
+"""Exports the violence model to ONNX for the onnx inference backend.
+
+    python export_onnx.py --output v_inception_i3d.onnx
+
+Needs `tf2onnx` at export time only, workers running the exported graph
+need `onnxruntime` but not TensorFlow:
+
+    ViolenceModel(backend='onnx', model_path='v_inception_i3d.onnx')
+"""
+import argparse
+
+import tensorflow as tf
+import tf2onnx
+
+from model.keras_backend import KerasBackend
+from model.model import labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default='v_inception_i3d.onnx')
+    parser.add_argument('--opset', type=int, default=17)
+    parser.add_argument('--float-input', action='store_true',
+                        help='take float32 clips in [-1,1] instead of uint8 frames')
+    args = parser.parse_args()
+
+    frame_dims = (224, 224, 3)
+    rescale_input = not args.float_input
+    model = KerasBackend.loadModel(numberOfClasses=len(labels), inputFrames=None, frameDims=frame_dims,
+                                   withWeights='v_inception_i3d', rescaleInput=rescale_input)
+
+    # batch and frame dimensions stay dynamic so one graph serves every clip size
+    dtype = tf.uint8 if rescale_input else tf.float32
+    signature = [tf.TensorSpec((None, None, *frame_dims), dtype, name='clip')]
+    infer = tf.function(lambda clip: model(clip, training=False), input_signature=signature)
+    tf2onnx.convert.from_function(infer, input_signature=signature, opset=args.opset, output_path=args.output)
+    print('exported', args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Exports the violence model to TFLite and compares it with the float model.
+
+    python export_tflite.py --clip-size 32 --quantization int8 \
+        --calibration-videos sample_video.mp4 --eval-dir ./eval_clips
+
+`--eval-dir` holds one sub directory per label (see txt/violence_labels.txt)
+with the videos of that class.
+"""
+import argparse
+import os
+
+from model.keras_backend import KerasBackend
+from model.model import labels
+from model.tflite_backend import QUANTIZATION_MODES, TFLiteRunner, compare_models, export_tflite
+
+
+def labeled_videos(eval_dir):
+    videos = []
+    for class_index, label in enumerate(labels):
+        class_dir = os.path.join(eval_dir, label)
+        if not os.path.isdir(class_dir):
+            continue
+        for name in sorted(os.listdir(class_dir)):
+            videos.append((os.path.join(class_dir, name), class_index))
+    return videos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clip-size', type=int, default=32)
+    parser.add_argument('--quantization', choices=QUANTIZATION_MODES, default='dynamic')
+    parser.add_argument('--calibration-videos', nargs='*', default=['sample_video.mp4'])
+    parser.add_argument('--eval-dir', default=None)
+    parser.add_argument('--max-eval-clips', type=int, default=None, help='clips per evaluation video')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    output = args.output or 'v_inception_i3d_%d_%s.tflite' % (args.clip_size, args.quantization)
+    frame_dims = (224, 224, 3)
+
+    model = KerasBackend.loadModel(numberOfClasses=len(labels), inputFrames=None, frameDims=frame_dims,
+                                    withWeights='v_inception_i3d', rescaleInput=True)
+    export_tflite(model, output, args.clip_size, frame_dims, rescale_input=True,
+                  quantization=args.quantization, calibration_videos=args.calibration_videos)
+    print('exported', output, '(%.1f MB)' % (os.path.getsize(output) / 2**20))
+
+    if args.eval_dir:
+        float_predict = KerasBackend.compileModel(model, args.clip_size, frame_dims, rescaleInput=True)
+        report = compare_models(float_predict, TFLiteRunner(output).predict, labeled_videos(args.eval_dir),
+                                args.clip_size, rescale_input=True, max_clips=args.max_eval_clips)
+        for key, value in report.items():
+            print('%-20s %s' % (key, round(value, 4)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import threading
+
+
+class FrameBroadcaster():
+    """Publishes the latest frame of a paced source to any number of subscribers.
+
+    One thread drains `source`, subscribers wake up on each new frame and
+    skip whatever they were too slow to see. `encode` runs at most once per
+    frame, the first subscriber asking for the encoded frame pays for it and
+    the rest reuse the result. `source` may yield `(frame, label, encoded)`
+    with the frame already encoded.
+    """
+
+    def __init__(self, source, encode):
+        self.source = source
+        self.encode = encode
+
+        self.seq = 0
+        self.frame = None
+        self.label = None
+        self.published = None # encoded bytes of frame when the source already encoded it
+        self.done = False
+
+        self.encoded = None
+        self.encoded_seq = 0
+        self.encoded_subscribers = 0
+        self.encode_lock = threading.Lock()
+
+        self.frame_lock = threading.Lock()
+        self.frame_cv = threading.Condition(self.frame_lock)
+
+        self.thread = threading.Thread(target=self.loop)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def loop(self):
+        try:
+            for frame, label, *encoded in self.source:
+                #an encode in progress never holds up publishing, it only guards the on-demand cache
+                with self.frame_cv:
+                    self.seq += 1
+                    self.frame = frame
+                    self.label = label
+                    self.published = encoded[0] if encoded else None
+                    self.frame_cv.notify_all()
+        finally:
+            with self.frame_cv:
+                self.done = True
+                self.frame_cv.notify_all()
+
+    def latest(self, after):
+        """Blocks until a frame newer than `after` exists, returns None once the source ended."""
+        with self.frame_cv:
+            self.frame_cv.wait_for(lambda: self.seq > after or self.done)
+            if self.seq == after:
+                return None
+            return self.seq, self.frame, self.label, self.published
+
+    def encoded_frame(self, seq, frame, label, published = None):
+        if published is not None:
+            return published
+        #a slow subscriber gets the newer frame another one already encoded
+        with self.encode_lock:
+            if self.encoded_seq < seq:
+                self.encoded = self.encode(frame, label)
+                self.encoded_seq = seq
+            return self.encoded
+
+    def subscribe(self, encoded = False):
+        """Yields `(frame, label)` or, with `encoded`, `(bytes, label)` at the subscriber's pace."""
+        seq = 0
+        if encoded:
+            with self.frame_cv:
+                self.encoded_subscribers += 1
+        try:
+            while True:
+                latest = self.latest(seq)
+                if latest is None:
+                    break
+                seq, frame, label, published = latest
+                if encoded:
+                    frame = self.encoded_frame(seq, frame, label, published)
+                yield frame, label
+        finally:
+            if encoded:
+                with self.frame_cv:
+                    self.encoded_subscribers -= 1
@@ -0,0 +1,184 @@
+import cv2
+import numpy as np
+import threading
+import time
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+class FrameBuffer():
+    """Fixed capacity ring of uint8 frames backed by one preallocated slab.
+
+    The slab holds `capacity` ring slots plus `window` mirror slots, every
+    write to one of the first `window` slots is mirrored after the end of the
+    ring so any read of up to `window` frames is a contiguous zero-copy view.
+    Frames returned by `read` stay valid until the next call to `read` or
+    `release`, readers that copy the view release it early so the ring can
+    drop its oldest frames instead of refusing new ones.
+    Each slot also keeps the monotonic (`time.perf_counter`) time its frame
+    was captured and its motion energy, `clip_stamps` and `clip_motion` hold
+    those of the real frames of the last view.
+    """
+
+    def __init__(self, capacity, window, overflow=DROP_OLDEST):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('overflow should be one of %s' % str(OVERFLOW_POLICIES))
+        if capacity < window:
+            raise ValueError('capacity must be at least the read window')
+
+        self.capacity = capacity
+        self.window = window
+        self.overflow = overflow
+
+        self.slab = None
+        self.stamps = None
+        self.frame_shape = None
+        self.clip_stamps = np.empty(0)
+        self.motion = None
+        self.clip_motion = np.empty(0)
+
+        self.start = 0      # first unreleased frame
+        self.count = 0      # unreleased frames (held by reader + unread)
+        self.held = 0       # frames at start that belong to the last view
+        self.position = 0   # stream index of the frame at start
+        self.seen = 0       # stream index after the last frame handed to the reader
+        self.overlap = 0    # leading frames of the last view shared with the view before it
+        self.available = 0  # real (not looped) frames in the last view
+        self.dropped = 0
+        self.lagging = False # frames were refused while the reader's view was pinned
+
+        self.closed = False
+        self.lock = threading.Lock()
+        self.cv = threading.Condition(self.lock)
+
+    def allocate(self, frame_shape):
+        self.frame_shape = tuple(frame_shape)
+        self.slab = np.zeros((self.capacity + self.window, *self.frame_shape), dtype=np.uint8)
+        self.stamps = np.zeros(self.capacity + self.window)
+        self.motion = np.zeros(self.capacity + self.window)
+
+    def reserve(self, frame_shape, timeout=None):
+        """Returns a writable slot for the next frame or None if it should be dropped."""
+        with self.cv:
+            if self.slab is None:
+                self.allocate(frame_shape)
+
+            if self.count == self.capacity:
+                if self.overflow == BLOCK:
+                    self.cv.wait_for(lambda: self.count < self.capacity or self.closed, timeout=timeout)
+                    if self.count == self.capacity:
+                        return None
+                elif self.overflow == DROP_OLDEST and not self.held:
+                    self.drop_oldest(1)
+                else:
+                    #frames pinned by the reader's view cannot be dropped yet, the next read skips to the newest ones
+                    self.lagging = self.overflow == DROP_OLDEST
+                    self.dropped += 1
+                    return None
+
+            return self.slab[(self.start + self.count) % self.capacity]
+
+    def commit(self, frame=None, timestamp=None, motion=0.):
+        """Publishes the reserved slot, copying `frame` into it if it was decoded elsewhere."""
+        timestamp = time.perf_counter() if timestamp is None else timestamp
+        with self.cv:
+            index = (self.start + self.count) % self.capacity
+            slot = self.slab[index]
+            if frame is not None and frame.ctypes.data != slot.ctypes.data:
+                if frame.shape != slot.shape:
+                    #source changed resolution, scale into the slot
+                    cv2.resize(frame, (slot.shape[1], slot.shape[0]), dst=slot)
+                else:
+                    np.copyto(slot, frame)
+            self.stamps[index] = timestamp
+            self.motion[index] = motion
+            if index < self.window:
+                self.slab[self.capacity + index] = slot
+                self.stamps[self.capacity + index] = timestamp
+                self.motion[self.capacity + index] = motion
+            self.count += 1
+            self.cv.notify_all()
+
+    def push(self, frame, timeout=None, timestamp=None, motion=0.):
+        if self.reserve(frame.shape, timeout=timeout) is None:
+            return False
+        self.commit(frame, timestamp, motion)
+        return True
+
+    def read(self, clip_size, hop=None, is_live=lambda: False, timeout=0.01):
+        """Returns a `(clip_size,H,W,3)` view of the oldest unread frames.
+
+        Frames from the previous view are released first, `hop` frames are
+        consumed and the remaining `clip_size - hop` stay in the ring so the
+        next view overlaps with this one. `overlap` and `available` tell
+        which frames of the view were not handed out before. Once frames
+        were refused under DROP_OLDEST the view skips ahead to the newest
+        ones, the skipped frames count as dropped. Short clips at the end of
+        the stream are looped into a new array, None is returned when no
+        unseen frames are left and nothing more will arrive.
+        """
+        hop = clip_size if hop is None else hop
+        if clip_size > self.window:
+            raise ValueError('clip_size is larger than the buffer read window')
+        if not 0 < hop <= clip_size:
+            raise ValueError('hop should be between 1 and clip_size')
+
+        with self.cv:
+            self.release_held()
+            if self.lagging:
+                #a live reader fell behind, catch up on the newest frames
+                self.drop_oldest(max(0, self.count - clip_size))
+                self.lagging = False
+            while self.count < clip_size and is_live() and not self.closed:
+                self.cv.wait(timeout=timeout)
+
+            if not len(self):
+                return None
+
+            available = min(self.count, clip_size)
+            clip = self.slab[self.start:self.start + available]
+            self.clip_stamps = self.stamps[self.start:self.start + available].copy()
+            self.clip_motion = self.motion[self.start:self.start + available].copy()
+            self.held = min(hop, available)
+            self.overlap = max(0, self.seen - self.position)
+            self.available = available
+            self.seen = self.position + available
+
+        #loop clip if not enough frames
+        if available < clip_size:
+            clip = np.resize(clip, (clip_size, *clip.shape[1:]))
+        return clip
+
+    def release(self):
+        """Hands the `hop` consumed frames of the last view back to the ring, the view must not be used after."""
+        with self.cv:
+            self.release_held()
+
+    def release_held(self):
+        if self.held:
+            self.start = (self.start + self.held) % self.capacity
+            self.position += self.held
+            self.count -= self.held
+            self.held = 0
+            self.cv.notify_all()
+
+    def drop_oldest(self, frames):
+        #overlap frames the reader already got are not lost, only unseen ones count as dropped
+        unseen = max(0, self.position + frames - max(self.seen, self.position))
+        self.start = (self.start + frames) % self.capacity
+        self.position += frames
+        self.count -= frames
+        self.dropped += unseen
+
+    def close(self):
+        with self.cv:
+            self.closed = True
+            self.cv.notify_all()
+
+    def __len__(self):
+        #frames not handed to the reader yet
+        return max(0, self.position + self.count - max(self.seen, self.position))
+
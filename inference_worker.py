@@ -0,0 +1,45 @@
+"""Serves the violence model to remote coordinators over TCP.
+
+    python inference_worker.py --host 0.0.0.0 --port 5600 --backend keras
+
+Coordinators use it with `ViolenceModel(backend='remote', workers=['host:5600', ...])`,
+clips sent by every coordinator are batched together.
+"""
+import argparse
+
+from model.backends import load_backend
+from model.model import labels
+from model.remote_backend import DEFAULT_PORT, InferenceServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='0.0.0.0 accepts coordinators from other machines, connections are not authenticated')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--backend', default='keras', help='keras, tflite, onnx or process')
+    parser.add_argument('--model-path', default=None, help='model file of the tflite and onnx backends')
+    parser.add_argument('--max-batch-size', type=int, default=8)
+    parser.add_argument('--max-wait', type=float, default=0.01, help='seconds a clip waits for a fuller batch')
+    parser.add_argument('--clip-sizes', type=int, nargs='*', default=[32], help='clip sizes to warm up at start')
+    args = parser.parse_args()
+
+    options = {'model_path': args.model_path} if args.model_path else {}
+    backend = load_backend(args.backend, frame_dims=(224, 224, 3), rescale_input=True, num_classes=len(labels),
+                           **options)
+    for clip_size in args.clip_sizes:
+        backend.warm_up(clip_size)
+
+    server = InferenceServer(backend, args.host, args.port, args.max_batch_size, args.max_wait)
+    print('inference worker listening on %s:%d' % server.address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        backend.release()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import math
+import numpy as np
+from collections import deque
+
+
+class JitterBuffer():
+    """Adaptive playout delay for frames that arrive in clip sized bursts.
+
+    Tracks how long each clip takes to come out of the model and keeps
+    enough frames buffered to ride out the `percentile`-th slowest clip
+    of the last `window` ones. Lower percentiles favour latency, higher
+    ones smoothness. Playback slows down by up to `max_adjust` when the
+    buffer runs below target and, with `catch_up`, speeds up when it holds
+    more than twice the target, so the delay follows the machine instead
+    of being fixed by the first clip. Files leave `catch_up` off, their
+    buffer holds most of the video and they should play at their own rate.
+    """
+
+    def __init__(self, fps = 30, percentile = 95, window = 32, max_adjust = 0.1, catch_up = True):
+        self.spf = 1/fps
+        self.percentile = percentile
+        self.max_adjust = max_adjust
+        self.catch_up = catch_up
+
+        self.clip_times = deque(maxlen=window)
+        self.clip_frames = deque(maxlen=window)
+
+        self.interval = self.spf
+        self.target = None
+
+    def observe(self, clip_seconds, frames):
+        """Records that `frames` new frames took `clip_seconds` to produce."""
+        if frames <= 0:
+            return
+        self.clip_times.append(clip_seconds)
+        self.clip_frames.append(frames)
+
+        #play no faster than frames are produced, otherwise the buffer drains and stalls
+        production_spf = sum(self.clip_times) / sum(self.clip_frames)
+        self.interval = max(self.spf, production_spf)
+
+        #frames needed to cover the gap until a slow clip arrives
+        gap = np.percentile(self.clip_times, self.percentile)
+        self.target = max(1, math.ceil(gap / self.interval))
+
+    def ready(self, buffered):
+        return self.target is not None and buffered >= self.target
+
+    def frame_interval(self, buffered):
+        """Seconds until the next frame should be shown with `buffered` frames waiting."""
+        if self.target is None:
+            return self.interval
+        if buffered < self.target:
+            return self.interval * (1 + self.max_adjust * (1 - buffered / self.target))
+        if self.catch_up and buffered > 2 * self.target:
+            return max(self.spf, self.interval) * (1 - self.max_adjust)
+        return self.interval
+
+    def delay(self, buffered):
+        """Seconds of video waiting to be shown."""
+        return buffered * self.interval
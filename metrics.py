@@ -0,0 +1,313 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+class Metric():
+    """Base for a named metric with optional label dimensions.
+
+    `labels(...)` returns the child holding the values for one set of label
+    values, metrics without label names are their own single child.
+    """
+    kind = None
+
+    def __init__(self, name, help, labelnames = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        if len(values) != len(self.labelnames):
+            raise ValueError('%s expects labels %s' % (self.name, str(self.labelnames)))
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def label_string(self, values, extra = ()):
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                                 for key, value in pairs)
+
+    def samples(self):
+        with self.lock:
+            children = list(self.children.items())
+        if not children and not self.labelnames:
+            children = [((), self.labels())]
+        for values, child in children:
+            yield from child.samples(self, values)
+
+    def exposition(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s %s' % (self.name, self.kind)]
+        lines += ['%s%s %s' % (name, labels, format_value(value)) for name, labels, value in self.samples()]
+        return '\n'.join(lines)
+
+
+class CounterValue():
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount = 1):
+        if amount < 0:
+            raise ValueError('counters only go up')
+        with self.lock:
+            self.value += amount
+
+    def samples(self, metric, values):
+        yield metric.name + '_total', metric.label_string(values), self.value
+
+
+class GaugeValue():
+    def __init__(self):
+        self.value = 0
+        self.function = None
+        self.lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount = 1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount = 1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        """Reads the value from `function` at scrape time instead, None goes back to `set` values."""
+        self.function = function
+
+    def get(self):
+        function = self.function
+        if function is not None:
+            try:
+                return function()
+            except Exception:
+                return float('nan')
+        return self.value
+
+    def samples(self, metric, values):
+        yield metric.name, metric.label_string(values), self.get()
+
+
+class HistogramValue():
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return Timer(self.observe)
+
+    def samples(self, metric, values):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            yield metric.name + '_bucket', metric.label_string(values, [('le', format_value(bound))]), cumulative
+        yield metric.name + '_sum', metric.label_string(values), total
+        yield metric.name + '_count', metric.label_string(values), cumulative
+
+
+class Timer():
+    """Context manager passing the seconds spent inside it to `observe`."""
+    def __init__(self, observe):
+        self.observe = observe
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.observe(time.perf_counter() - self.start)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def new_child(self):
+        return CounterValue()
+
+    def inc(self, amount = 1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def new_child(self):
+        return GaugeValue()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function):
+        self.labels().set_function(function)
+
+    def unbind(self, values, function):
+        """Removes the child of `values` if it still reads `function`, a newer owner keeps its child."""
+        with self.lock:
+            child = self.children.get(tuple(values))
+            if child is not None and child.function == function:
+                del self.children[tuple(values)]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames = (), buckets = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def new_child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    if value != value:
+        return 'NaN'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry():
+    """Holds metrics by name and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError('metric %s already registered differently' % metric.name)
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help, labelnames = ()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames = ()):
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames = (), buckets = LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def exposition(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return '\n'.join(metric.exposition() for metric in metrics) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+#pipeline instruments, label values are the stage, queue or buffer they describe
+STAGE_SECONDS = REGISTRY.histogram('rtvd_stage_seconds',
+                                   'Seconds spent per item in each stage (decode, preprocess, inference, render, encode)',
+                                   ('stage',))
+FRAMES = REGISTRY.counter('rtvd_frames', 'Frames that left each stage (capture, classify, output, emit)', ('stage',))
+DROPPED_FRAMES = REGISTRY.counter('rtvd_dropped_frames', 'Frames dropped by each buffer (capture, output)', ('buffer',))
+QUEUE_FRAMES = REGISTRY.gauge('rtvd_queue_frames', 'Frames waiting in each queue (capture, output)', ('queue', 'session'))
+BUFFER_BYTES = REGISTRY.gauge('rtvd_buffer_bytes', 'Bytes held by each frame buffer (capture, output)', ('buffer', 'session'))
+CLIPS = REGISTRY.counter('rtvd_clips', 'Clips classified')
+FPS = REGISTRY.gauge('rtvd_fps', 'Frames per second at each point (capture, processing, playback)', ('stage', 'session'))
+STREAMING_DELAY = REGISTRY.gauge('rtvd_streaming_delay_seconds', 'Seconds of video waiting to be played', ('session',))
+PIPELINE_QUEUE_CLIPS = REGISTRY.gauge('rtvd_pipeline_queue_clips', 'Clips waiting for each processing stage',
+                                      ('stage', 'session'))
+SKIPPED_CLIPS = REGISTRY.counter('rtvd_skipped_clips', 'Clips labeled NonViolence without inference for lack of motion')
+CLIP_MOTION = REGISTRY.histogram('rtvd_clip_motion', 'Strongest frame motion energy of each gated clip',
+                                 buckets=(.001, .0025, .005, .0075, .01, .015, .02, .03, .05, .1))
+FRAME_LATENCY = REGISTRY.histogram('rtvd_frame_latency_seconds',
+                                   'Seconds from capture until a frame entered each stage (classify, output, render, emit)',
+                                   ('stage',), buckets=(.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60))
+
+
+def bind_gauges(gauges):
+    """Reads every `(gauge, label values, function)` at scrape time, returns them for unbind_gauges."""
+    for gauge, values, function in gauges:
+        gauge.labels(*values).set_function(function)
+    return gauges
+
+
+def unbind_gauges(gauges):
+    #drops the children, so finished sessions are neither reported nor kept alive by the functions
+    for gauge, values, function in gauges:
+        gauge.unbind(values, function)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.exposition().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+metrics_server = None
+metrics_server_lock = threading.Lock()
+
+
+def serve_metrics(port, addr = '127.0.0.1'):
+    """Starts the process wide endpoint for REGISTRY once, later calls return the running server or None."""
+    global metrics_server
+    with metrics_server_lock:
+        if metrics_server is None:
+            try:
+                metrics_server = start_http_server(port, addr)
+            except OSError as error:
+                print("Metrics endpoint disabled, port %d: %s" % (port, error))
+                metrics_server = False
+        return metrics_server or None
+
+
+def start_http_server(port, addr = '127.0.0.1', registry = REGISTRY):
+    """Serves `registry` on http://addr:port/metrics from a daemon thread, returns the server."""
+    handler = type('RegistryHandler', (MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,49 @@
+BACKENDS = ['keras', 'tflite', 'onnx', 'process', 'remote']
+
+
+class InferenceBackend():
+    """Runs the I3D classifier on batches of preprocessed clips.
+
+    Backends receive `(N,T,H,W,3)` batches, uint8 when `rescale_input` is
+    set and float32 in [-1,1] otherwise, and return `(N,classes)` scores.
+    """
+
+    def __init__(self, frame_dims = (224,224,3), rescale_input = True, num_classes = 2):
+        self.frame_dims = frame_dims
+        self.rescale_input = rescale_input
+        self.num_classes = num_classes
+        # batches infer can run at once, a BatchScheduler keeps that many in flight
+        self.concurrency = 1
+
+    def load(self):
+        raise NotImplementedError
+
+    def warm_up(self, clip_size):
+        """Prepares the backend for clips of `clip_size` frames."""
+        pass
+
+    def infer(self, batch):
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+
+def load_backend(name, **kwargs):
+    """Creates and loads a backend by name, importing only its own runtime."""
+    if name == 'keras':
+        from .keras_backend import KerasBackend as Backend
+    elif name == 'tflite':
+        from .tflite_backend import TFLiteBackend as Backend
+    elif name == 'onnx':
+        from .onnx_backend import OnnxBackend as Backend
+    elif name == 'process':
+        from .process_backend import ProcessBackend as Backend
+    elif name == 'remote':
+        from .remote_backend import RemoteBackend as Backend
+    else:
+        raise ValueError('backend should be one of %s' % str(BACKENDS))
+
+    backend = Backend(**kwargs)
+    backend.load()
+    return backend
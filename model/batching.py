@@ -0,0 +1,120 @@
+import numpy as np
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class BatchScheduler():
+    """Collects preprocessed clips from many streams and runs them as batches.
+
+    A batch is sent to `predict_batch` once it holds `max_batch_size` clips
+    or its oldest clip has waited `max_wait` seconds. Clips are grouped by
+    shape, so streams using different clip sizes never share a batch.
+    Up to `concurrency` batches run at once, for backends that can run them
+    in parallel (see InferenceBackend.concurrency).
+    """
+
+    def __init__(self, predict_batch, max_batch_size = 8, max_wait = 0.01, concurrency = 1):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.pending = deque([])
+        self.local = threading.local() # batch buffers of each worker thread
+
+        self.stop_flag = threading.Event()
+        self.pending_lock = threading.Lock()
+        self.pending_cv = threading.Condition(self.pending_lock)
+
+        self.workers = [threading.Thread(target=self.loop) for _ in range(max(1, concurrency))]
+        for worker in self.workers:
+            worker.daemon = True
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        return self
+
+    def stop(self):
+        self.stop_flag.set()
+        with self.pending_cv:
+            self.pending_cv.notify_all()
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.join()
+        #fail whatever never made it into a batch
+        while self.pending:
+            _, _, future = self.pending.popleft()
+            future.set_exception(RuntimeError('BatchScheduler stopped'))
+
+    def submit(self, clip):
+        """Queues one `(T,H,W,3)` clip, the future resolves to its class scores."""
+        future = Future()
+        with self.pending_cv:
+            if self.stop_flag.is_set():
+                raise RuntimeError('BatchScheduler stopped')
+            self.pending.append((time.perf_counter(), clip, future))
+            self.pending_cv.notify_all()
+        return future
+
+    def predict(self, clips):
+        #same call signature as a batch-of-n predict function
+        futures = [self.submit(clip) for clip in clips]
+        return np.stack([future.result() for future in futures])
+
+    def loop(self):
+        while not self.stop_flag.is_set():
+            batch = self.next_batch()
+            if batch:
+                self.run(batch)
+
+    def next_batch(self):
+        with self.pending_cv:
+            self.pending_cv.wait_for(lambda: self.pending or self.stop_flag.is_set())
+            if self.stop_flag.is_set():
+                return []
+
+            #wait for the batch to fill up, but not longer than the oldest clip may wait
+            deadline = self.pending[0][0] + self.max_wait
+            shape = self.pending[0][1].shape
+            while not self.stop_flag.is_set():
+                same_shape = sum(1 for request in self.pending if request[1].shape == shape)
+                remaining = deadline - time.perf_counter()
+                if same_shape >= self.max_batch_size or remaining <= 0:
+                    break
+                self.pending_cv.wait(timeout=remaining)
+
+            batch = []
+            rest = deque([])
+            while self.pending:
+                request = self.pending.popleft()
+                if request[1].shape == shape and len(batch) < self.max_batch_size:
+                    batch.append(request)
+                else:
+                    rest.append(request)
+            self.pending = rest
+            return batch
+
+    def run(self, batch):
+        if not hasattr(self.local, 'batch_buffers'):
+            self.local.batch_buffers = {}
+        shape = batch[0][1].shape
+        buffer = self.local.batch_buffers.get(shape)
+        if buffer is None or buffer.dtype != batch[0][1].dtype:
+            buffer = np.empty((self.max_batch_size, *shape), dtype=batch[0][1].dtype)
+            self.local.batch_buffers[shape] = buffer
+
+        #copy into the batch so callers can reuse their clip buffers once resolved
+        for i, (_, clip, _) in enumerate(batch):
+            buffer[i] = clip
+
+        try:
+            predictions = self.predict_batch(buffer[:len(batch)])
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        for i, (_, _, future) in enumerate(batch):
+            future.set_result(predictions[i])
@@ -27,6 +27,7 @@ from keras.layers import Dropout
 from keras.layers import Reshape
 from keras.layers import Lambda
 from keras.layers import GlobalAveragePooling3D
+from keras.layers import Rescaling
 
 from keras.utils import get_file
 from keras import backend as K
@@ -157,7 +158,9 @@ def _obtain_input_shape(input_shape,
             else:
                 input_shape = (None, None, None, 3)
     if require_flatten:
-        if None in input_shape:
+        # the number of frames may stay dynamic, the classifier averages over time
+        frame_dims = input_shape[2:] if data_format == 'channels_first' else input_shape[1:]
+        if None in frame_dims:
             raise ValueError('If `include_top` is True, '
                              'you should specify a static `input_shape`. '
                              'Got `input_shape=' + str(input_shape) + '`')
@@ -228,7 +231,8 @@ def Inception_Inflated3d(include_top=True,
                 input_shape=None,
                 dropout_prob=0.0,
                 endpoint_logit=True,
-                classes=400, modelId = 'i3d'):
+                classes=400, modelId = 'i3d',
+                input_rescaling=False):
     """Instantiates the Inflated 3D Inception v1 architecture.
 
     Optionally loads weights pre-trained
@@ -254,6 +258,7 @@ def Inception_Inflated3d(include_top=True,
             has to be `(NUM_FRAMES, 224, 224, 3)` (with `channels_last` data format)
             or `(NUM_FRAMES, 3, 224, 224)` (with `channels_first` data format).
             It should have exactly 3 inputs channels.
+            NUM_FRAMES may be None to build one model for any number of frames.
             NUM_FRAMES should be no smaller than 8. The authors used 64
             frames per example for training and testing on kinetics dataset
             Also, Width and height should be no smaller than 32.
@@ -274,6 +279,9 @@ def Inception_Inflated3d(include_top=True,
         classes: optional number of classes to classify images
             into, only to be specified if `include_top` is True, and
             if no `weights` argument is specified.
+        input_rescaling: (boolean) optional. If True, the model takes uint8
+            frames in [0,255] and scales them to [-1,1] with a `Rescaling`
+            layer at the graph input, so the caller does not have to.
 
     # Returns
         A Keras model instance.
@@ -306,7 +314,7 @@ def Inception_Inflated3d(include_top=True,
         weights=weights)
 
     if input_tensor is None:
-        img_input = Input(shape=input_shape)
+        img_input = Input(shape=input_shape, dtype='uint8' if input_rescaling else None)
     else:
         if not K.is_keras_tensor(input_tensor):
             img_input = Input(tensor=input_tensor, shape=input_shape)
@@ -318,8 +326,12 @@ def Inception_Inflated3d(include_top=True,
     else:
         channel_axis = 4
 
+    x = img_input
+    if input_rescaling:
+        x = Rescaling(scale=2/255., offset=-1, name='input_rescaling')(x)
+
     # Downsampling via convolution (spatial and temporal)
-    x = conv3d_bn(img_input, 64, 7, 7, 7, strides=(2, 2, 2), padding='same')
+    x = conv3d_bn(x, 64, 7, 7, 7, strides=(2, 2, 2), padding='same')
 
     # Downsampling (spatial only)
     x = MaxPooling3D((1, 3, 3), strides=(1, 2, 2), padding='same')(x)
@@ -489,7 +501,7 @@ def Inception_Inflated3d(include_top=True,
         x = conv3d_bn(x, classes, 1, 1, 1, padding='same',
                 use_bias=True, use_activation_fn=False, use_bn=False)
 
-        num_frames_remaining = int(x.shape[1])
+        num_frames_remaining = -1 if x.shape[1] is None else int(x.shape[1])
         x = Reshape((num_frames_remaining, classes))(x)
 
         # logits (raw scores for each class)
@@ -0,0 +1,126 @@
+import numpy as np
+import tensorflow as tf
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from .i3d_inception import Inception_Inflated3d
+from .backends import InferenceBackend
+
+
+class KerasBackend(InferenceBackend):
+
+    def __init__(self, frame_dims = (224,224,3), rescale_input = True, num_classes = 2,
+                 weights = 'v_inception_i3d', jit_compile = False, max_compiled = 4):
+        super().__init__(frame_dims, rescale_input, num_classes)
+        self.weights = weights
+        self.model = None
+
+        # traced inference functions (single clip and batched) of up to max_compiled clip sizes, least recently used is dropped first
+        self.jit_compile = jit_compile
+        self.max_compiled = max_compiled
+        self.compiled = OrderedDict()
+        self.compiled_lock = threading.Lock()
+
+    def load(self):
+        KerasBackend.init_gpu()
+        # one graph with a dynamic number of frames serves every clip size with a single copy of the weights
+        self.model = KerasBackend.loadModel(numberOfClasses = self.num_classes, inputFrames = None, frameDims = self.frame_dims,
+                                            withWeights = self.weights, rescaleInput = self.rescale_input)
+
+    def warm_up(self, clip_size):
+        #trace the inference function once per clip size, later switches reuse it
+        self.predict_fn(clip_size)
+
+    def infer(self, batch):
+        return self.predict_fn(batch.shape[1], batched = len(batch) > 1)(batch)
+
+    def release(self):
+        with self.compiled_lock:
+            self.compiled.clear()
+        self.model = None
+
+    def predict_fn(self, clip_size, batched = False):
+        with self.compiled_lock:
+            if clip_size in self.compiled:
+                self.compiled.move_to_end(clip_size)
+            else:
+                self.compiled[clip_size] = {}
+                if len(self.compiled) > self.max_compiled:
+                    self.compiled.popitem(last=False)
+            functions = self.compiled[clip_size]
+            future = functions.get(batched)
+            compiling = future is None
+            if compiling:
+                future = functions[batched] = Future()
+
+        #tracing takes seconds, streams on other clip sizes keep predicting and callers of this one wait for it
+        if compiling:
+            try:
+                future.set_result(KerasBackend.compileModel(self.model, clip_size, self.frame_dims, self.rescale_input,
+                                                            self.jit_compile, batchSize = None if batched else 1))
+            except Exception as error:
+                with self.compiled_lock:
+                    if functions.get(batched) is future:
+                        del functions[batched]
+                future.set_exception(error)
+        return future.result()
+
+    @staticmethod
+    def loadModel(numberOfClasses,inputFrames, frameDims,withWeights = None, rescaleInput = False):
+
+        weights = None
+        if withWeights : weights = withWeights
+        model = Inception_Inflated3d(
+                    include_top=True,
+                    weights=weights,
+                    input_shape=(inputFrames, *frameDims),
+                    dropout_prob=0.5,
+                    endpoint_logit=False,
+                    classes=numberOfClasses,
+                    input_rescaling=rescaleInput,
+                    )
+
+        #model._make_predict_function()
+        if inputFrames:
+            KerasBackend.warmUp(model, inputFrames, frameDims, rescaleInput)
+
+        return model
+
+    @staticmethod
+    def warmUp(model, inputFrames, frameDims, rescaleInput = False):
+        model.predict(KerasBackend.randomInput(inputFrames, frameDims, rescaleInput), verbose=0)
+
+    @staticmethod
+    def compileModel(model, inputFrames, frameDims, rescaleInput = False, jitCompile = False, batchSize = 1):
+        """Returns a traced inference function for clips of `inputFrames` frames.
+
+        Unlike `model.predict` it does not set up a data adapter on every call.
+        `batchSize` None traces it for any batch size.
+        """
+        dtype = tf.uint8 if rescaleInput else tf.float32
+        signature = [tf.TensorSpec((batchSize, inputFrames, *frameDims), dtype)]
+        infer = tf.function(lambda clip: model(clip, training=False),
+                            input_signature=signature, jit_compile=jitCompile)
+
+        def predict(clip):
+            return infer(clip).numpy()
+
+        predict(KerasBackend.randomInput(inputFrames, frameDims, rescaleInput))
+        return predict
+
+    @staticmethod
+    def randomInput(inputFrames, frameDims, rescaleInput = False):
+        if rescaleInput:
+            return np.random.randint(0,256,(1,inputFrames,*frameDims),dtype=np.uint8)
+        return np.random.rand(1,inputFrames,*frameDims).astype(np.float32)
+
+    @staticmethod
+    def init_gpu():
+        gpus = tf.config.experimental.list_physical_devices('GPU')
+        if gpus:
+            try:
+                # Set memory growth for each GPU
+                for gpu in gpus:
+                    tf.config.experimental.set_memory_growth(gpu, True)
+            except RuntimeError as e:
+                print(e)
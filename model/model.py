@@ -1,14 +1,11 @@
 import numpy as np
-from keras.layers import Dropout
-from keras.layers import Reshape
-from keras.layers import Lambda
-from .i3d_inception import Inception_Inflated3d,conv3d_bn
-from keras.models import Model
-from keras.layers import Activation
-from keras import backend as K
-import tensorflow as tf
-from model.classification import classify_clip, calculate_prediction
+from model.classification import calculate_prediction
+from model.transforms import preprocess_clip
+from model.batching import BatchScheduler
+from model.transforms import MODEL_CHANNEL_ORDER
+from model.backends import load_backend, InferenceBackend
 from collections import deque
+from metrics import STAGE_SECONDS, FRAMES, CLIPS, SKIPPED_CLIPS, CLIP_MOTION
 
 
 LABEL_FILE = './txt/violence_labels.txt'
@@ -18,23 +15,89 @@ labels = [x.strip() for x in open(LABEL_FILE)]
 
 class ViolenceModel():
 
-    def __init__(self, clip_size = 64, memory = 3, threshold = 60 ,frame_dims = (224,224,3)):
-        self.init_gpu()
-        self.model = ViolenceModel.loadModel(numberOfClasses = len(labels), inputFrames = clip_size,frameDims= frame_dims
-                                    ,withWeights= 'v_inception_i3d')
+    def __init__(self, clip_size = 64, memory = 3, threshold = 60 ,frame_dims = (224,224,3), rescale_input = True,
+                 backend = 'keras', **backend_options):
+        # rescale_input moves the [-1,1] scaling into the graph so clips are fed as uint8
+        self.rescale_input = rescale_input
+        # backend is 'keras', 'tflite', 'onnx', 'process' (any of the others in worker processes, e.g.
+        # backend='process', inner='keras', workers=2) or 'remote' (inference_worker.py servers, e.g.
+        # workers=['gpu1:5600', 'gpu2:5600']), backend_options go to its constructor (model_path, jit_compile, ...)
+        # a loaded InferenceBackend is shared instead, see session()
+        self.shared = isinstance(backend, InferenceBackend)
+        if self.shared:
+            self.backend = backend
+        else:
+            self.backend = load_backend(backend, frame_dims = frame_dims, rescale_input = rescale_input,
+                                        num_classes = len(labels), **backend_options)
+        self.scheduler = None
 
         self.frame_dims = frame_dims
         self.threshold = threshold/100
         self.memory = memory
         self.clip_size = clip_size
+        self.hop = clip_size
+        self.stride = 1
+        # clips whose strongest frame motion is below motion_threshold skip inference, 0 runs every clip
+        self.motion_threshold = 0
+        self.cache_valid = False # input_buffer holds the last classified clip
 
 
         self.prediction_buffer = deque([])
-
-    def classify(self, clip):
-        prediction = classify_clip(self.model,clip)
+        self.input_buffer = self.new_input_buffer()
+        self.warm_up(clip_size)
+
+        self.preprocess_seconds = STAGE_SECONDS.labels('preprocess')
+        self.inference_seconds = STAGE_SECONDS.labels('inference')
+        self.classified_frames = FRAMES.labels('classify')
+
+    def classify(self, clip, overlap=0, channel_order=MODEL_CHANNEL_ORDER, motion=None):
+        # overlap: leading frames of clip that ended the previously classified clip
+        # channel_order: 'BGR' or 'RGB' order of the clip's frames
+        # motion: strongest frame motion energy of the clip (VideoCapture.clip_motion), None never skips
+        if self.gate(motion):
+            self.cache_valid = False
+            return self.skip(len(clip) - overlap)
+        #frames of a skipped clip were never preprocessed, nothing to reuse
+        prediction = self.predict(self.preprocess(clip, overlap if self.cache_valid else 0, channel_order))
+        self.cache_valid = True
+        return self.decide(prediction, len(clip) - overlap)
+
+    def gate(self, motion):
+        """True when a clip with `motion` energy should skip inference."""
+        if motion is None or not self.motion_threshold:
+            return False
+        CLIP_MOTION.observe(motion)
+        return motion < self.motion_threshold
+
+    def skip(self, new_frames):
+        #a static clip counts as a confident NonViolence prediction, so the memory still moves on
+        self.classified_frames.inc(new_frames)
+        CLIPS.inc()
+        SKIPPED_CLIPS.inc()
+        prediction = np.zeros(len(labels))
+        prediction[0] = 1
+        self.remember(prediction)
+        return {'label': labels[0], 'score': 100.0, 'skipped': True}
+
+    #the steps of classify, pipelined callers run them on different threads
+    def preprocess(self, clip, overlap=0, channel_order=MODEL_CHANNEL_ORDER, out=None, previous=None):
+        # out: input buffer to fill instead of the model's own, previous: the buffer of the clip before
+        with self.preprocess_seconds.time():
+            return preprocess_clip(clip, out=self.input_buffer if out is None else out, normalize=not self.rescale_input,
+                                   cached=overlap, channel_order=channel_order, previous=previous)
+
+    def predict(self, processed_clip):
+        predict = self.scheduler.predict if self.scheduler else self.backend.infer
+        with self.inference_seconds.time():
+            return predict(processed_clip)[0]
+
+    def decide(self, prediction, new_frames):
+        #called in clip order, the label averages the last `memory` predictions
+        self.classified_frames.inc(new_frames)
+        CLIPS.inc()
         self.remember(prediction)
         label = calculate_prediction(self.prediction_buffer,labels,self.threshold)
+        label['skipped'] = False
         return label
 
     def remember(self,prediction):
@@ -48,40 +111,51 @@ class ViolenceModel():
 
         self.threshold = config.threshold/100
         self.memory = config.memory
+        self.hop = config.hop or config.clip_size
+        self.stride = max(1, config.stride)
+        self.motion_threshold = config.motion_threshold
         self.prediction_buffer = deque([])
+        self.cache_valid = False
 
         if self.clip_size != config.clip_size:
             self.clip_size = config.clip_size
-            self.model = None
-            K.clear_session()
-            self.model = ViolenceModel.loadModel(numberOfClasses = len(labels), inputFrames = self.clip_size,frameDims= self.frame_dims
-                                    ,withWeights= 'v_inception_i3d')
-
-    @staticmethod
-    def loadModel(numberOfClasses,inputFrames, frameDims,withWeights = None):
-
-        weights = None
-        if withWeights : weights = withWeights
-        model = Inception_Inflated3d(
-                    include_top=True,
-                    weights=weights,
-                    input_shape=(inputFrames, *frameDims),
-                    dropout_prob=0.5,
-                    endpoint_logit=False,
-                    classes=numberOfClasses,
-                    )
-
-        #model._make_predict_function()
-        data = np.random.rand(1,inputFrames,224,224,3)
-        model.predict(data)
-
-        return model
-    def init_gpu(self):
-        gpus = tf.config.experimental.list_physical_devices('GPU')
-        if gpus:
-            try:
-                # Set memory growth for each GPU
-                for gpu in gpus:
-                    tf.config.experimental.set_memory_growth(gpu, True)
-            except RuntimeError as e:
-                print(e)
+            self.input_buffer = self.new_input_buffer()
+            self.warm_up(self.clip_size)
+
+    def session(self, clip_size = None, memory = None, threshold = None):
+        """Returns a model with its own config, prediction memory and input buffer on this one's weights.
+
+        Sessions predict through this model's batch scheduler when batching is
+        enabled, so clips of concurrent sessions share batches. Releasing a
+        session leaves the backend and scheduler running.
+        """
+        threshold = self.threshold*100 if threshold is None else threshold
+        session = ViolenceModel(clip_size = clip_size or self.clip_size, memory = memory or self.memory, threshold = threshold,
+                                frame_dims = self.frame_dims, rescale_input = self.rescale_input, backend = self.backend)
+        session.scheduler = self.scheduler
+        return session
+
+    def new_input_buffer(self):
+        dtype = np.uint8 if self.rescale_input else np.float32
+        return np.empty((1, self.clip_size, *self.frame_dims), dtype=dtype)
+
+    def warm_up(self, clip_size):
+        self.backend.warm_up(clip_size)
+
+    def enable_batching(self, max_batch_size = 8, max_wait = 0.01):
+        """Routes predictions through a scheduler that batches clips across streams."""
+        if self.shared:
+            raise RuntimeError('batching is configured on the model the session was created from')
+        self.disable_batching()
+        self.scheduler = BatchScheduler(self.backend.infer, max_batch_size, max_wait, self.backend.concurrency).start()
+
+    def disable_batching(self):
+        #a session only lets go of the shared scheduler
+        if self.scheduler and not self.shared:
+            self.scheduler.stop()
+        self.scheduler = None
+
+    def release(self):
+        self.disable_batching()
+        if not self.shared:
+            self.backend.release()
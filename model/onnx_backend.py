@@ -0,0 +1,39 @@
+import numpy as np
+import onnxruntime as ort
+from .backends import InferenceBackend
+
+
+class OnnxBackend(InferenceBackend):
+    """Runs an I3D graph exported with `export_onnx.py` on ONNX Runtime.
+
+    The exported graph has dynamic batch and frame dimensions, so one
+    session serves every clip size.
+    """
+
+    def __init__(self, frame_dims = (224,224,3), rescale_input = True, num_classes = 2, model_path = None,
+                 providers = None, num_threads = None):
+        super().__init__(frame_dims, rescale_input, num_classes)
+        if not model_path:
+            raise ValueError('the onnx backend needs a model_path')
+        self.model_path = model_path
+        self.providers = providers or ['CPUExecutionProvider']
+        self.num_threads = num_threads
+        self.session = None
+
+    def load(self):
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.num_threads:
+            options.intra_op_num_threads = self.num_threads
+        self.session = ort.InferenceSession(self.model_path, sess_options=options, providers=self.providers)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def warm_up(self, clip_size):
+        dtype = np.uint8 if self.rescale_input else np.float32
+        self.infer(np.zeros((1, clip_size, *self.frame_dims), dtype=dtype))
+
+    def infer(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+    def release(self):
+        self.session = None
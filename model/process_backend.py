@@ -0,0 +1,228 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import numpy as np
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from .backends import InferenceBackend, load_backend
+
+
+class WorkerExited(RuntimeError):
+    pass
+
+
+def worker_main(backend, backend_options, shm_name, slot_bytes, cpus, tasks, results):
+    """Inference process: loads `backend` and runs the batches the parent leaves in shared memory slots."""
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        model = load_backend(backend, **backend_options)
+        results.put((None, 'ready', None))
+    except Exception as error:
+        results.put((None, None, repr(error)))
+        shm.close()
+        return
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        request_id, command, args = task
+        try:
+            if command == 'warm_up':
+                model.warm_up(args)
+                result = None
+            else:
+                slot, shape, dtype = args
+                batch = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=slot*slot_bytes)
+                result = np.asarray(model.infer(batch), dtype=np.float32)
+                del batch
+            results.put((request_id, result, None))
+        except Exception as error:
+            results.put((request_id, None, repr(error)))
+
+    model.release()
+    shm.close()
+
+
+class ProcessBackend(InferenceBackend):
+    """Runs another backend in `workers` separate processes, away from this process's GIL.
+
+    Batches are copied into slots of one shared memory block and workers read
+    them in place, only slot numbers and the `(N,classes)` scores are sent
+    between processes. Each call goes to the worker with the fewest batches
+    in flight, `cpu_affinity` optionally pins worker i to the CPUs in
+    `cpu_affinity[i]` (e.g. one socket each). A slot holds `slot_frames`
+    frames, larger batches are split. `infer` may be called from several
+    threads, a BatchScheduler keeps a batch in flight per worker. Batches of
+    a worker that died are retried on the workers still alive.
+    """
+
+    def __init__(self, frame_dims = (224,224,3), rescale_input = True, num_classes = 2, inner = 'keras', workers = 1,
+                 slots = None, slot_frames = 256, cpu_affinity = None, **inner_options):
+        super().__init__(frame_dims, rescale_input, num_classes)
+        self.inner = inner
+        self.inner_options = dict(inner_options, frame_dims=frame_dims, rescale_input=rescale_input,
+                                  num_classes=num_classes)
+        self.workers = max(1, workers)
+        self.concurrency = self.workers
+        self.slots = slots or 2*self.workers
+        self.slot_frames = slot_frames
+        self.cpu_affinity = cpu_affinity
+
+        self.dtype = np.dtype(np.uint8 if rescale_input else np.float32)
+        self.slot_bytes = slot_frames * int(np.prod(frame_dims)) * self.dtype.itemsize
+
+        self.shm = None
+        self.processes = []
+        self.tasks = []
+        self.in_flight = []
+        self.dead = set()
+        self.free_slots = queue.Queue()
+        self.pending = {}
+        self.request_ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.collector = None
+        self.stop_flag = threading.Event()
+
+    def load(self):
+        #spawned workers never inherit an initialized TensorFlow runtime
+        context = multiprocessing.get_context('spawn')
+        self.shm = shared_memory.SharedMemory(create=True, size=self.slots*self.slot_bytes)
+        for slot in range(self.slots):
+            self.free_slots.put(slot)
+
+        self.results = context.Queue()
+        for i in range(self.workers):
+            cpus = self.cpu_affinity[i] if self.cpu_affinity else None
+            tasks = context.Queue()
+            process = context.Process(target=worker_main, args=(self.inner, self.inner_options, self.shm.name,
+                                                                self.slot_bytes, cpus, tasks, self.results))
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+            self.tasks.append(tasks)
+            self.in_flight.append(0)
+
+        #every worker loads its own copy of the model before the first batch
+        ready = 0
+        while ready < self.workers:
+            try:
+                _, status, error = self.results.get(timeout=1)
+            except queue.Empty:
+                if all(process.is_alive() for process in self.processes):
+                    continue
+                error = 'worker exited'
+            if error:
+                self.release()
+                raise RuntimeError('inference worker failed to load: %s' % error)
+            ready += 1
+
+        self.stop_flag.clear()
+        self.collector = threading.Thread(target=self.collect)
+        self.collector.daemon = True
+        self.collector.start()
+
+    def collect(self):
+        #a killed worker can leave the results queue locked, so stopping never relies on it
+        while not self.stop_flag.is_set():
+            #results of live workers keep coming, so liveness is checked on every pass
+            self.fail_dead_workers()
+            try:
+                request_id, result, error = self.results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with self.lock:
+                entry = self.pending.pop(request_id, None)
+                if entry is None:
+                    continue
+                future, worker = entry
+                self.in_flight[worker] -= 1
+            if error:
+                future.set_exception(RuntimeError('inference worker: %s' % error))
+            else:
+                future.set_result(result)
+
+    def fail_dead_workers(self):
+        #a crashed worker never answers, fail its batches instead of waiting forever and stop sending it more
+        with self.lock:
+            self.dead.update(worker for worker, process in enumerate(self.processes) if not process.is_alive())
+            failed = [request_id for request_id, (_, worker) in self.pending.items() if worker in self.dead]
+            futures = [self.pending.pop(request_id)[0] for request_id in failed]
+            for worker in self.dead:
+                self.in_flight[worker] = 0
+        for future in futures:
+            future.set_exception(WorkerExited('inference worker exited'))
+
+    def live_workers(self):
+        return [worker for worker in range(len(self.processes)) if worker not in self.dead]
+
+    def submit(self, command, args, worker = None):
+        future = Future()
+        with self.lock:
+            if worker is None:
+                live = self.live_workers()
+                if not live:
+                    raise RuntimeError('no inference worker left')
+                worker = min(live, key=lambda worker: self.in_flight[worker])
+            request_id = next(self.request_ids)
+            self.pending[request_id] = (future, worker)
+            self.in_flight[worker] += 1
+        self.tasks[worker].put((request_id, command, args))
+        return future
+
+    def warm_up(self, clip_size):
+        futures = [self.submit('warm_up', clip_size, worker) for worker in self.live_workers()]
+        for future in futures:
+            future.result()
+
+    def infer(self, batch):
+        frames_per_clip = batch.shape[1]
+        per_slot = max(1, self.slot_frames // frames_per_clip)
+        if len(batch) > per_slot:
+            return np.concatenate([self.infer(batch[i:i+per_slot]) for i in range(0, len(batch), per_slot)])
+        if batch.nbytes > self.slot_bytes:
+            raise ValueError('clip of %d frames does not fit a %d frame slot' % (frames_per_clip, self.slot_frames))
+
+        #a free slot is the only copy of the batch, waiting for one applies backpressure
+        slot = self.free_slots.get()
+        try:
+            view = np.ndarray(batch.shape, dtype=self.dtype, buffer=self.shm.buf, offset=slot*self.slot_bytes)
+            np.copyto(view, batch, casting='unsafe')
+            del view
+            #workers only read the slot, the batch of one that died is still there for another
+            while True:
+                try:
+                    return self.submit('infer', (slot, batch.shape, self.dtype.str)).result()
+                except WorkerExited:
+                    pass
+        finally:
+            self.free_slots.put(slot)
+
+    def release(self):
+        for worker, tasks in enumerate(self.tasks):
+            if self.processes[worker].is_alive():
+                tasks.put(None)
+            else:
+                tasks.cancel_join_thread()
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        if self.collector:
+            self.stop_flag.set()
+            self.collector.join()
+        with self.lock:
+            for future, _ in self.pending.values():
+                future.set_exception(RuntimeError('inference workers stopped'))
+            self.pending.clear()
+        if self.shm:
+            self.shm.close()
+            self.shm.unlink()
+        self.processes, self.tasks, self.in_flight = [], [], []
+        self.dead = set()
+        self.collector = None
+        self.shm = None
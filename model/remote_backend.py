@@ -0,0 +1,427 @@
+import itertools
+import json
+import socket
+import socketserver
+import struct
+import threading
+import time
+import numpy as np
+from concurrent.futures import Future, TimeoutError
+from .backends import InferenceBackend
+from .batching import BatchScheduler
+
+# every message is a 4 byte header length, a JSON header and `nbytes` of raw array data
+HEADER_SIZE = struct.Struct('!I')
+DEFAULT_PORT = 5600
+MAX_HEADER_BYTES = 64 << 10
+MAX_PAYLOAD_BYTES = 1 << 30 # a batch of 8 float32 clips of 64 frames is ~300MB
+ARRAY_KINDS = 'biuf'
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def send_message(sock, header, payload = None):
+    nbytes = payload.nbytes if payload is not None else 0
+    data = json.dumps(dict(header, nbytes=nbytes)).encode()
+    sock.sendall(HEADER_SIZE.pack(len(data)) + data)
+    if nbytes:
+        sock.sendall(payload)
+
+
+def recv_exact(sock, size):
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise ConnectionError('connection closed')
+        received += count
+    return data
+
+
+def recv_message(sock, max_payload = MAX_PAYLOAD_BYTES):
+    #sizes come from the peer, anything out of bounds ends the connection before it is allocated
+    size, = HEADER_SIZE.unpack(recv_exact(sock, HEADER_SIZE.size))
+    if size > MAX_HEADER_BYTES:
+        raise ProtocolError('header of %d bytes' % size)
+    header = json.loads(recv_exact(sock, size))
+    if not isinstance(header, dict) or not isinstance(header.get('nbytes'), int) or 'type' not in header:
+        raise ProtocolError('malformed header')
+    if not 0 <= header['nbytes'] <= max_payload:
+        raise ProtocolError('payload of %d bytes' % header['nbytes'])
+    payload = recv_exact(sock, header['nbytes']) if header['nbytes'] else None
+    return header, payload
+
+
+def array_payload(array):
+    return memoryview(np.ascontiguousarray(array)).cast('B')
+
+
+def payload_array(header, payload):
+    try:
+        dtype = np.dtype(header['dtype'])
+        shape = tuple(int(size) for size in header['shape'])
+    except (KeyError, TypeError, ValueError):
+        raise ProtocolError('malformed array header')
+    if dtype.kind not in ARRAY_KINDS or any(size < 0 for size in shape):
+        raise ProtocolError('unexpected array %s %s' % (dtype, shape))
+    nbytes = len(payload) if payload is not None else 0
+    if int(np.prod(shape)) * dtype.itemsize != nbytes:
+        raise ProtocolError('array %s %s does not match %d payload bytes' % (dtype, shape, nbytes))
+    return np.frombuffer(payload, dtype=dtype).reshape(shape) if nbytes else np.empty(shape, dtype)
+
+
+class WorkerLost(Exception):
+    pass
+
+
+class WorkerTCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class WorkerRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.inference_server.handle(self.request)
+
+
+class InferenceServer():
+    """Serves a loaded InferenceBackend to RemoteBackend coordinators over TCP.
+
+    Clips from every connection are batched together by one BatchScheduler,
+    pings are answered right away with the number of clips in flight so
+    coordinators can send work where it will wait the least. Connections are
+    not authenticated, the server listens on localhost unless `host` says
+    otherwise (e.g. '0.0.0.0' on a trusted network). Malformed or oversized
+    messages close the connection.
+    """
+
+    def __init__(self, backend, host = '127.0.0.1', port = DEFAULT_PORT, max_batch_size = 8, max_wait = 0.01):
+        self.backend = backend
+        self.scheduler = BatchScheduler(backend.infer, max_batch_size, max_wait, backend.concurrency).start()
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.connections = set()
+
+        self.tcp_server = WorkerTCPServer((host, port), WorkerRequestHandler)
+        self.tcp_server.inference_server = self
+        self.address = self.tcp_server.server_address
+
+    def serve_forever(self):
+        self.tcp_server.serve_forever()
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def shutdown(self):
+        self.tcp_server.shutdown()
+        self.tcp_server.server_close()
+        #coordinators see the worker go away and retry its clips elsewhere
+        with self.lock:
+            connections = list(self.connections)
+        for sock in connections:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.scheduler.stop()
+
+    def handle(self, sock):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        send_lock = threading.Lock()
+        with self.lock:
+            self.connections.add(sock)
+
+        def reply(header, payload = None):
+            with send_lock:
+                send_message(sock, header, payload)
+
+        try:
+            reply({'type': 'hello', 'frame_dims': list(self.backend.frame_dims),
+                   'rescale_input': self.backend.rescale_input, 'num_classes': self.backend.num_classes})
+            while True:
+                header, payload = recv_message(sock)
+                kind = header['type']
+                if not isinstance(header.get('id'), int):
+                    raise ProtocolError('%s message without id' % kind)
+                if kind == 'ping':
+                    reply({'type': 'pong', 'id': header['id'], 'load': self.in_flight})
+                elif kind == 'warm_up' and isinstance(header.get('clip_size'), int) and header['clip_size'] > 0:
+                    self.start_job(reply, header, None)
+                elif kind == 'infer':
+                    batch = payload_array(header, payload)
+                    if batch.ndim != 5 or tuple(batch.shape[2:]) != tuple(self.backend.frame_dims):
+                        raise ProtocolError('unexpected batch shape %s' % str(batch.shape))
+                    self.start_job(reply, header, batch)
+                else:
+                    raise ProtocolError('unexpected %s message' % kind)
+        except (ConnectionError, OSError, ValueError):
+            #the coordinator went away, dropped this worker or broke the protocol
+            pass
+        finally:
+            with self.lock:
+                self.connections.discard(sock)
+
+    def start_job(self, reply, header, batch):
+        #slow requests run on their own thread so pings keep being answered
+        job = threading.Thread(target=self.run, args=(reply, header, batch))
+        job.daemon = True
+        job.start()
+
+    def run(self, reply, header, batch):
+        try:
+            if header['type'] == 'warm_up':
+                self.backend.warm_up(header['clip_size'])
+                reply({'type': 'result', 'id': header['id']})
+                return
+            with self.lock:
+                self.in_flight += len(batch)
+            try:
+                scores = self.scheduler.predict(batch).astype(np.float32)
+            finally:
+                with self.lock:
+                    self.in_flight -= len(batch)
+            reply({'type': 'result', 'id': header['id'], 'shape': list(scores.shape), 'dtype': scores.dtype.str},
+                  array_payload(scores))
+        except (ConnectionError, OSError):
+            pass
+        except Exception as error:
+            try:
+                reply({'type': 'error', 'id': header['id'], 'error': repr(error)})
+            except (ConnectionError, OSError):
+                pass
+
+
+class WorkerConnection():
+    """One coordinator connection to an InferenceServer, requests are pipelined and matched by id."""
+
+    def __init__(self, address):
+        host, _, port = address.rpartition(':')
+        self.address = address
+        self.host = host or 'localhost'
+        self.port = int(port or DEFAULT_PORT)
+
+        self.sock = None
+        self.alive = False
+        self.pending = {}
+        self.in_flight = 0
+        self.load = 0
+        self.last_seen = 0
+        self.ids = itertools.count(1)
+        self.send_lock = threading.Lock()
+        self.lock = threading.Lock()
+
+    def connect(self, timeout):
+        sock = socket.create_connection((self.host, self.port), timeout=timeout)
+        header, _ = recv_message(sock)
+        if header['type'] != 'hello':
+            sock.close()
+            raise ConnectionError('%s is not an inference worker' % self.address)
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.lock:
+            self.sock = sock
+            self.alive = True
+            self.load = 0
+            self.last_seen = time.monotonic()
+        reader = threading.Thread(target=self.read, args=(sock,))
+        reader.daemon = True
+        reader.start()
+        return header
+
+    def read(self, sock):
+        try:
+            while True:
+                header, payload = recv_message(sock)
+                self.last_seen = time.monotonic()
+                if header['type'] == 'pong':
+                    self.load = header['load']
+                    continue
+                with self.lock:
+                    future = self.pending.pop(header['id'], None)
+                if future is None:
+                    continue
+                if header['type'] == 'error':
+                    future.set_exception(RuntimeError('%s: %s' % (self.address, header['error'])))
+                else:
+                    future.set_result(payload_array(header, payload) if 'shape' in header else None)
+        except (ConnectionError, OSError, ValueError, KeyError, TypeError):
+            self.lost(sock)
+
+    def request(self, header, payload = None):
+        future = Future()
+        with self.lock:
+            if not self.alive:
+                raise WorkerLost(self.address)
+            request_id = next(self.ids)
+            self.pending[request_id] = future
+            self.in_flight += 1
+            sock = self.sock
+        future.add_done_callback(self.done)
+        try:
+            with self.send_lock:
+                send_message(sock, dict(header, id=request_id), payload)
+        except OSError:
+            self.lost(sock)
+        return future
+
+    def done(self, future):
+        with self.lock:
+            self.in_flight -= 1
+
+    def ping(self):
+        try:
+            with self.send_lock:
+                send_message(self.sock, {'type': 'ping', 'id': 0})
+        except OSError:
+            self.lost(self.sock)
+
+    def lost(self, sock):
+        #fails everything in flight, callers retry it on another worker
+        with self.lock:
+            if sock is not self.sock or not self.alive:
+                return
+            self.alive = False
+            pending = list(self.pending.values())
+            self.pending.clear()
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+        for future in pending:
+            future.set_exception(WorkerLost(self.address))
+
+    def close(self):
+        if self.sock:
+            self.lost(self.sock)
+
+
+class RemoteBackend(InferenceBackend):
+    """Sends preprocessed batches to InferenceServer workers (`inference_worker.py`) over TCP.
+
+    `workers` lists `host:port` addresses. Each batch goes to the live
+    worker with the least work, taken as the larger of the batches this
+    coordinator has in flight there and the clips the worker reported in its
+    last heartbeat. A worker that stops answering for `timeout` seconds is
+    dropped, its batches are retried elsewhere up to `retries` times and it
+    is reconnected in the background.
+    """
+
+    def __init__(self, frame_dims = (224,224,3), rescale_input = True, num_classes = 2, workers = ('localhost:%d' % DEFAULT_PORT,),
+                 heartbeat = 1.0, timeout = 5.0, retries = 2, connect_timeout = 5.0, request_timeout = None):
+        super().__init__(frame_dims, rescale_input, num_classes)
+        if isinstance(workers, str):
+            workers = workers.split(',')
+        self.connections = [WorkerConnection(address.strip()) for address in workers]
+        self.heartbeat = heartbeat
+        self.timeout = timeout
+        self.retries = retries
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        # a batch in flight per worker when batched through a BatchScheduler
+        self.concurrency = len(self.connections)
+
+        self.reconnecting = set()
+        self.reconnect_lock = threading.Lock()
+        self.clip_sizes = set()
+        self.stop_flag = threading.Event()
+        self.monitor_thread = None
+
+    def load(self):
+        for connection in self.connections:
+            self.connect(connection)
+        if not any(connection.alive for connection in self.connections):
+            raise RuntimeError('no inference worker reachable at %s' % ', '.join(c.address for c in self.connections))
+
+        self.stop_flag.clear()
+        self.monitor_thread = threading.Thread(target=self.monitor)
+        self.monitor_thread.daemon = True
+        self.monitor_thread.start()
+
+    def connect(self, connection):
+        try:
+            hello = connection.connect(self.connect_timeout)
+        except OSError:
+            return False
+        if tuple(hello['frame_dims']) != tuple(self.frame_dims) or hello['rescale_input'] != self.rescale_input:
+            print('inference worker %s serves another input format, ignored' % connection.address)
+            connection.close()
+            return False
+        #a reconnected worker prepares the clip sizes in use before it gets work
+        for clip_size in self.clip_sizes:
+            connection.request({'type': 'warm_up', 'clip_size': clip_size})
+        return True
+
+    def monitor(self):
+        while not self.stop_flag.wait(self.heartbeat):
+            for connection in self.connections:
+                if not connection.alive:
+                    self.start_reconnect(connection)
+                elif time.monotonic() - connection.last_seen > self.timeout:
+                    connection.lost(connection.sock)
+                else:
+                    connection.ping()
+
+    def start_reconnect(self, connection):
+        #connecting can take connect_timeout, the heartbeat of the other workers goes on meanwhile
+        with self.reconnect_lock:
+            if connection in self.reconnecting:
+                return
+            self.reconnecting.add(connection)
+        thread = threading.Thread(target=self.reconnect, args=(connection,))
+        thread.daemon = True
+        thread.start()
+
+    def reconnect(self, connection):
+        try:
+            if self.connect(connection) and self.stop_flag.is_set():
+                connection.close()
+        finally:
+            with self.reconnect_lock:
+                self.reconnecting.discard(connection)
+
+    def pick(self, exclude):
+        live = [connection for connection in self.connections if connection.alive and connection not in exclude]
+        if not live:
+            raise RuntimeError('no inference worker available')
+        return min(live, key=lambda connection: max(connection.in_flight, connection.load))
+
+    def warm_up(self, clip_size):
+        self.clip_sizes.add(clip_size)
+        futures = []
+        for connection in self.connections:
+            try:
+                futures.append(connection.request({'type': 'warm_up', 'clip_size': clip_size}))
+            except WorkerLost:
+                pass
+        for future in futures:
+            try:
+                future.result()
+            except WorkerLost:
+                pass
+
+    def infer(self, batch):
+        header = {'type': 'infer', 'shape': list(batch.shape), 'dtype': batch.dtype.str}
+        payload = array_payload(batch)
+        tried = []
+        for _ in range(self.retries + 1):
+            connection = self.pick(tried)
+            try:
+                return connection.request(header, payload).result(timeout=self.request_timeout)
+            except (WorkerLost, TimeoutError):
+                tried.append(connection)
+        raise RuntimeError('batch failed on %d inference workers' % len(tried))
+
+    def release(self):
+        self.stop_flag.set()
+        if self.monitor_thread:
+            self.monitor_thread.join()
+        for connection in self.connections:
+            connection.close()
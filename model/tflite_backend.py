@@ -0,0 +1,166 @@
+import numpy as np
+import threading
+import cv2
+from .transforms import preprocess_clip
+from .backends import InferenceBackend
+
+try:
+    # the slim runtime keeps TensorFlow out of inference only images
+    from tflite_runtime.interpreter import Interpreter
+except ImportError:
+    Interpreter = None
+
+QUANTIZATION_MODES = ['none', 'dynamic', 'float16', 'int8']
+
+
+class TFLiteRunner():
+    """Runs an exported fixed-shape I3D TFLite model, one clip per invoke."""
+
+    def __init__(self, model_path, num_threads = None):
+        interpreter = Interpreter
+        if interpreter is None:
+            import tensorflow as tf
+            interpreter = tf.lite.Interpreter
+        self.interpreter = interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()[0]
+        self.output_details = self.interpreter.get_output_details()[0]
+        self.lock = threading.Lock()
+
+    def predict(self, batch):
+        input_dtype = self.input_details['dtype']
+        predictions = []
+        with self.lock:
+            for clip in batch:
+                clip = np.expand_dims(clip, axis=0)
+                if clip.dtype != input_dtype:
+                    clip = clip.astype(input_dtype)
+                self.interpreter.set_tensor(self.input_details['index'], clip)
+                self.interpreter.invoke()
+                predictions.append(self.interpreter.get_tensor(self.output_details['index'])[0])
+        return np.stack(predictions)
+
+
+class TFLiteBackend(InferenceBackend):
+    """Runs exported TFLite models, `model_path` is formatted with the clip_size."""
+
+    def __init__(self, frame_dims = (224,224,3), rescale_input = True, num_classes = 2, model_path = None,
+                 num_threads = None):
+        super().__init__(frame_dims, rescale_input, num_classes)
+        if not model_path:
+            raise ValueError('the tflite backend needs a model_path')
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self.runners = {}
+
+    def load(self):
+        pass
+
+    def warm_up(self, clip_size):
+        self.runner(clip_size)
+
+    def infer(self, batch):
+        return self.runner(batch.shape[1]).predict(batch)
+
+    def release(self):
+        self.runners = {}
+
+    def runner(self, clip_size):
+        if clip_size not in self.runners:
+            self.runners[clip_size] = TFLiteRunner(self.model_path.format(clip_size=clip_size), self.num_threads)
+        return self.runners[clip_size]
+
+
+def read_video_clips(video_path, clip_size, max_clips = None):
+    """Yields disjoint `(clip_size,H,W,3)` BGR clips from a video file."""
+    cap = cv2.VideoCapture(video_path)
+    clip = []
+    clips = 0
+    while cap.isOpened() and (max_clips is None or clips < max_clips):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        clip.append(frame)
+        if len(clip) == clip_size:
+            yield np.stack(clip)
+            clip = []
+            clips += 1
+    cap.release()
+
+
+def calibration_clips(video_paths, clip_size, rescale_input, max_clips = 32):
+    clips = []
+    for path in video_paths:
+        for clip in read_video_clips(path, clip_size):
+            clips.append(preprocess_clip(clip, normalize=not rescale_input))
+            if len(clips) == max_clips:
+                return clips
+    return clips
+
+
+def export_tflite(model, output_path, clip_size, frame_dims = (224,224,3), rescale_input = True,
+                  quantization = 'dynamic', calibration_videos = None):
+    """Converts a (dynamic length) I3D Keras model to a TFLite model for one clip size.
+
+    `quantization` is one of `QUANTIZATION_MODES`. 'int8' calibrates
+    activation ranges on clips taken from `calibration_videos`, ops without
+    an int8 kernel (such as CONV_3D on most builds) fall back to float.
+    """
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError('quantization should be one of %s' % str(QUANTIZATION_MODES))
+    import tensorflow as tf
+
+    dtype = tf.uint8 if rescale_input else tf.float32
+    infer = tf.function(lambda clip: model(clip, training=False),
+                        input_signature=[tf.TensorSpec((1, clip_size, *frame_dims), dtype)])
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([infer.get_concrete_function()], model)
+
+    if quantization != 'none':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        if not calibration_videos:
+            raise ValueError('int8 quantization needs calibration videos')
+        clips = calibration_clips(calibration_videos, clip_size, rescale_input)
+        converter.representative_dataset = lambda: ([clip] for clip in clips)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8,
+                                               tf.lite.OpsSet.TFLITE_BUILTINS]
+
+    tflite_model = converter.convert()
+    with open(output_path, 'wb') as f:
+        f.write(tflite_model)
+    return output_path
+
+
+def compare_models(float_predict, quantized_predict, labeled_videos, clip_size, rescale_input = True, max_clips = None):
+    """Scores both predict functions on local clips.
+
+    `labeled_videos` is a list of `(video_path, class_index)` pairs. Returns
+    the accuracy of both models, how often their top-1 agrees and the mean
+    absolute difference between their class scores.
+    """
+    float_correct = quantized_correct = agree = clips = 0
+    score_delta = 0.0
+    for video_path, class_index in labeled_videos:
+        for clip in read_video_clips(video_path, clip_size, max_clips):
+            batch = preprocess_clip(clip, normalize=not rescale_input)
+            float_scores = float_predict(batch)[0]
+            quantized_scores = quantized_predict(batch)[0]
+
+            float_correct += int(np.argmax(float_scores) == class_index)
+            quantized_correct += int(np.argmax(quantized_scores) == class_index)
+            agree += int(np.argmax(float_scores) == np.argmax(quantized_scores))
+            score_delta += float(np.abs(float_scores - quantized_scores).mean())
+            clips += 1
+
+    if not clips:
+        raise ValueError('no clips of %d frames found in the evaluation videos' % clip_size)
+    return {
+        'clips': clips,
+        'float_accuracy': float_correct / clips,
+        'quantized_accuracy': quantized_correct / clips,
+        'accuracy_delta': (quantized_correct - float_correct) / clips,
+        'top1_agreement': agree / clips,
+        'mean_score_delta': score_delta / clips,
+    }
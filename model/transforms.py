@@ -1,5 +1,10 @@
 import cv2
 import numpy as np
+
+# channel order the fine-tuned weights were fed (OpenCV decoded frames), frames
+# in another order are flipped while they are copied into the model input
+MODEL_CHANNEL_ORDER = 'BGR'
+CHANNEL_ORDERS = ('BGR', 'RGB')
 def loopVideo(clip,currentLength):
     i = currentLength
     j = 0 
@@ -38,3 +43,47 @@ def preprocess_input(img):
     frame = centerCrop(frame,224)
     frame = (frame/255.)*2 - 1  
     return frame
+
+def preprocess_clip(clip, out=None, dim=224, normalize=True, cached=0, channel_order=MODEL_CHANNEL_ORDER, previous=None):
+    """Preprocesses a `(T,H,W,3)` uint8 clip into a `(1,T,dim,dim,3)` batch.
+
+    The batch is float32 in [-1,1], or the cropped uint8 frames when
+    `normalize` is False and the model rescales its own input.
+    Pass the array returned by a previous call as `out` to reuse it, if the
+    first `cached` frames of `clip` were the last `cached` frames of that
+    call they are shifted to the front instead of being processed again.
+    When that call wrote to another array pass it as `previous`, the cached
+    frames are copied from there.
+    `channel_order` is the order of `clip`, it is converted to
+    MODEL_CHANNEL_ORDER as part of the crop copy.
+    """
+    clip_size = len(clip)
+    dtype = np.float32 if normalize else np.uint8
+    if out is None or out.shape != (1, clip_size, dim, dim, 3) or out.dtype != dtype:
+        out = np.empty((1, clip_size, dim, dim, 3), dtype=dtype)
+        if previous is None:
+            cached = 0
+    previous = out if previous is None else previous
+    if previous.shape != out.shape or previous.dtype != out.dtype:
+        cached = 0
+
+    #reuse frames shared with the previous window
+    if cached:
+        out[0, :cached] = previous[0, clip_size - cached:]
+
+    #resize and crop every new frame into one uint8 staging array
+    new = clip_size - cached
+    staged = out[0, cached:] if not normalize else np.empty((new, dim, dim, 3), dtype=np.uint8)
+    flip = channel_order != MODEL_CHANNEL_ORDER
+    for i in range(new):
+        frame = centerCrop(imageResize(clip[cached + i], 256), dim)
+        staged[i] = frame[..., ::-1] if flip else frame
+
+    if not normalize:
+        return out
+
+    #scale to [-1,1] in a single pass over the new frames
+    processed = out[0, cached:]
+    np.multiply(staged, np.float32(2/255.), out=processed, casting='unsafe')
+    np.subtract(processed, np.float32(1), out=processed)
+    return out
@@ -0,0 +1,28 @@
+import cv2
+
+
+class MotionEnergy():
+    """Motion between consecutive frames, measured on tiny grayscale copies.
+
+    Frames are shrunk to `width` pixels wide (a cheap linear step then an
+    area step that averages out sensor noise) and compared with the frame
+    before. The energy is the mean absolute difference scaled to [0,1],
+    static scenes stay around 0.001-0.005 and people moving reach 0.01+.
+    """
+
+    def __init__(self, width = 64):
+        self.width = width
+        self.previous = None
+
+    def measure(self, frame):
+        height, width = frame.shape[:2]
+        size = (self.width, max(1, round(height * self.width / width)))
+        coarse = cv2.resize(frame, (size[0]*4, size[1]*4), interpolation=cv2.INTER_LINEAR)
+        small = cv2.resize(coarse, size, interpolation=cv2.INTER_AREA)
+        #channel order barely changes the gray levels that are compared
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+        previous, self.previous = self.previous, gray
+        if previous is None or previous.shape != gray.shape:
+            return 0.
+        return cv2.norm(gray, previous, cv2.NORM_L1) / (gray.size * 255)
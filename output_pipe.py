@@ -2,19 +2,53 @@ import cv2
 import numpy as np
 import time
 from collections import deque
-from utils import write_label
+from utils import write_label, LABEL_BORDER
+from frame_broadcaster import FrameBroadcaster
+from jitter_buffer import JitterBuffer
+from tracing import LatencyTracer, OUTPUT, RENDER, EMIT
+from metrics import STAGE_SECONDS, FRAMES, DROPPED_FRAMES, QUEUE_FRAMES, BUFFER_BYTES, FPS, bind_gauges, unbind_gauges
 import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+STORAGE_MODES = ('raw', 'scaled', 'jpeg')
 
 class OutputPipe():
-    def __init__(self, fps = 30):
+    def __init__(self, fps = 30, storage = 'scaled', max_height = 720, max_bytes = 1 << 30, jpeg_quality = 90,
+                 render_workers = 2, channel_order = 'BGR', playout_percentile = 95, tracer = None, session = 'default',
+                 block = False):
+
+        # order of the frames handed to read_output, converted only where a consumer needs the other one
+        self.channel_order = channel_order
 
+        #one entry per clip: [frames, label, nbytes, trace], frames are stored compacted
         self.buffer = deque([])
-        self.labels = deque([])
+        self.position = 0 # next frame of the oldest clip
+
+        # storage: 'raw' keeps frames as is, 'scaled' downscales them to max_height, 'jpeg' also compresses them
+        if storage not in STORAGE_MODES:
+            raise ValueError('storage should be one of %s' % str(STORAGE_MODES))
+        self.storage = storage
+        self.max_height = max_height
+        self.jpeg_quality = jpeg_quality
+        self.max_bytes = max_bytes
+        self.buffer_bytes = 0
+        self.dropped_frames = 0
+        # block: files wait for room under max_bytes, which holds back the pipeline and capture, live streams drop old clips
+        self.block = block
+        self.full = False # a clip waits for room
 
         self.fps = fps
         self.spf = 1/fps
         self.current_fps = -1
 
+        #playout delay and pacing follow the observed clip times
+        self.jitter = JitterBuffer(fps, percentile=playout_percentile, catch_up=not block)
+        self.buffered_frames = 0
+        self.rendering_frames = 0
+
+        #capture to emit latency of every frame, sampled frames also go to a trace file
+        self.tracer = tracer or LatencyTracer()
+
         self.stop_flag = threading.Event()
         self.start_flag = threading.Event()
         self.terminate_flag = threading.Event()
@@ -22,40 +56,146 @@ class OutputPipe():
         self.buffer_lock = threading.Lock()
         self.buffer_cv = threading.Condition(self.buffer_lock)
 
-    def read_output(self, clip,label):
+        #OpenCV releases the GIL, so frames are resized, labeled and encoded ahead on a small pool
+        self.render_pool = ThreadPoolExecutor(render_workers) if render_workers else None
+        self.render_ahead = max(1, 2*render_workers)
+        self.render_local = threading.local()
+
+        self.render_seconds = STAGE_SECONDS.labels('render')
+        self.encode_seconds = STAGE_SECONDS.labels('encode')
+        self.output_frames = FRAMES.labels('output')
+        self.emitted_frames = FRAMES.labels('emit')
+        self.budget_drops = DROPPED_FRAMES.labels('output')
+        self.gauges = bind_gauges([
+            (QUEUE_FRAMES, ('output', session), lambda: self.buffered_frames + self.rendering_frames),
+            (BUFFER_BYTES, ('output', session), lambda: self.buffer_bytes),
+            (FPS, ('playback', session), lambda: max(self.current_fps, 0)),
+        ])
+
+        #frames are paced once and shared by every viewer
+        self.broadcaster = FrameBroadcaster(self.paced_stream(), self.render_frame).start()
+
+    def read_output(self, clip,label,trace=None):
+        # trace: ClipTrace with the capture times of clip's frames
+        if not len(clip):
+            return
+        self.append(*self.compact(clip), label, trace)
+
+    def append(self, frames, nbytes, label, trace=None):
+        #frames already compacted, see compact
+        if trace is not None:
+            trace.enter(OUTPUT)
+        self.output_frames.inc(len(frames))
         with self.buffer_cv:
-            self.buffer.extend(clip)
-            self.labels.extend([label]*len(clip))
+            if self.block and self.buffer and self.buffer_bytes + nbytes > self.max_bytes:
+                #playback starts now if it has not yet, it is the only way to make room
+                self.full = True
+                self.buffer_cv.notify_all()
+                self.buffer_cv.wait_for(lambda: self.buffer_bytes + nbytes <= self.max_bytes or not self.buffer
+                                        or self.terminate_flag.is_set())
+                self.full = False
+                if self.terminate_flag.is_set():
+                    return
+            self.buffer.append([frames, label, nbytes, trace])
+            self.buffer_bytes += nbytes
+            self.buffered_frames += len(frames)
+            self.enforce_budget()
             self.buffer_cv.notify_all()
 
-    def frame_stream(self):
-        
-        #wait until there is frames to stream
+    def observe(self, clip_seconds, frames):
+        """Feeds the time it took to produce the last `frames` output frames to the jitter buffer."""
+        with self.buffer_cv:
+            self.jitter.observe(clip_seconds, frames)
+            self.buffer_cv.notify_all()
+
+    def delay(self):
+        return self.jitter.delay(self.buffered_frames + self.rendering_frames)
+
+    def compact(self, clip):
+        #clip is a view into the capture ring, keep one compact copy of it
+        height, width = clip[0].shape[:2]
+        if self.storage != 'raw' and height > self.max_height:
+            size = (int(width * self.max_height / height), self.max_height)
+            scaled = np.empty((len(clip), size[1], size[0], 3), dtype=np.uint8)
+            for i, frame in enumerate(clip):
+                cv2.resize(frame, size, dst=scaled[i], interpolation=cv2.INTER_AREA)
+            clip = scaled
+        else:
+            clip = np.array(clip)
+
+        if self.storage == 'jpeg':
+            params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+            frames = [cv2.imencode('.jpg', frame, params)[1] for frame in clip]
+            return frames, sum(frame.nbytes for frame in frames)
+        return clip, clip.nbytes
+
+    def enforce_budget(self):
+        #drop the oldest clips that are not being played yet, never the newest one
+        first = 1 if self.position else 0
+        while self.buffer_bytes > self.max_bytes and len(self.buffer) - 1 > first:
+            frames, _, nbytes, _ = self.buffer[first]
+            del self.buffer[first]
+            self.buffer_bytes -= nbytes
+            self.buffered_frames -= len(frames)
+            self.dropped_frames += len(frames)
+            self.budget_drops.inc(len(frames))
+
+    def next_frame(self):
+        frames, label, nbytes, trace = self.buffer[0]
+        frame = frames[self.position]
+        index = self.position
+        self.position += 1
+        self.buffered_frames -= 1
+        if self.position == len(frames):
+            self.buffer.popleft()
+            self.buffer_bytes -= nbytes
+            self.position = 0
+            #room for a clip waiting in append
+            self.buffer_cv.notify_all()
+        return frame, label, trace, index
+
+    def paced_stream(self):
+
+        #wait until enough frames are buffered to ride out slow clips, or the input ended
         with self.buffer_cv:
-            self.buffer_cv.wait_for(lambda: self.start_flag.is_set() or self.terminate_flag.is_set())
+            self.buffer_cv.wait_for(lambda: self.start_flag.is_set() or self.terminate_flag.is_set()
+                                    or self.stop_flag.is_set() or self.jitter.ready(self.buffered_frames)
+                                    or self.full)
         if self.terminate_flag.is_set():
+            unbind_gauges(self.gauges)
             return
 
         #main output loop
         next_emit = time.perf_counter()
         last_emit_time = None
+        rendering = deque([])
 
         while True:
             #wait for data or terminate_flag
             with self.buffer_cv:
                 self.buffer_cv.wait_for(
-                    lambda: len(self.buffer) > 0 or self.stop_flag.is_set() or self.terminate_flag.is_set()
+                    lambda: len(self.buffer) > 0 or rendering or self.stop_flag.is_set() or self.terminate_flag.is_set()
                 )
 
                 if self.terminate_flag.is_set():
                     break
-                if len(self.buffer) == 0 and self.stop_flag.is_set():
+                if len(self.buffer) == 0 and not rendering and self.stop_flag.is_set():
                     #stop only after all frames are out
                     break
 
-                #pop frame
-                frame = self.buffer.popleft()
-                label = self.labels.popleft()
+                #pop frames to render ahead of their emit time
+                popped = []
+                while len(self.buffer) and len(rendering) + len(popped) < self.render_ahead:
+                    popped.append(self.next_frame())
+                self.rendering_frames = len(rendering) + len(popped)
+                spf = self.jitter.frame_interval(self.buffered_frames + self.rendering_frames)
+
+            for frame, label, trace, index in popped:
+                rendering.append((label, trace, index, time.perf_counter(), self.submit_render(frame, label)))
+
+            #frames come out in order, whichever worker finishes first
+            label, trace, index, rendered, job = rendering.popleft()
+            frame, encoded = job.result()
 
             #pace fps
             now = time.perf_counter()
@@ -65,11 +205,11 @@ class OutputPipe():
                 now = time.perf_counter()
 
             #update next emit time - avoid drift on long delays
-            if now > next_emit + self.spf:
+            if now > next_emit + spf:
                 #late -> reset schedule to now
-                next_emit = now + self.spf
+                next_emit = now + spf
             else:
-                next_emit += self.spf
+                next_emit += spf
 
             #update current_fps
             if last_emit_time is not None:
@@ -77,24 +217,69 @@ class OutputPipe():
                 self.current_fps = 1.0 / dt
             last_emit_time = now
 
+            self.emitted_frames.inc()
+            if trace is not None:
+                self.tracer.frame_done(trace, index, **{RENDER: rendered, EMIT: now})
+            yield frame, label, encoded
+
+        for *_, job in rendering:
+            job.cancel()
+        if self.render_pool:
+            self.render_pool.shutdown(wait=False)
+        self.tracer.write()
+        unbind_gauges(self.gauges)
+
+    def frame_stream(self):
+        label = None
+        for frame, label in self.broadcaster.subscribe():
             #format and send frame and label
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            if self.channel_order != 'RGB':
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             yield frame, label
 
         # black frame at the end
-        black = np.zeros((720, 1280, 3), dtype=np.uint8)
-        yield black, label
+        if label is not None:
+            black = np.zeros((720, 1280, 3), dtype=np.uint8)
+            yield black, label
+
+    def submit_render(self, frame, label):
+        if self.render_pool:
+            return self.render_pool.submit(self.render_job, frame, label)
+        job = Future()
+        job.set_result(self.render_job(frame, label))
+        return job
+
+    def render_job(self, frame, label):
+        if self.storage == 'jpeg':
+            frame = cv2.imdecode(frame, cv2.IMREAD_COLOR)
+        #encode ahead only on the pool and only while someone watches the labeled stream
+        encoded = None
+        if self.render_pool and self.broadcaster.encoded_subscribers:
+            encoded = self.render_frame(frame, label)
+        return frame, encoded
 
     def prepare_frame(self,frame,label):
-        frame = cv2.resize(frame,(1280,720))
-        frame = write_label(frame,label)
-        return frame
+        #resize straight into this thread's preallocated output frame, the banner goes on its bottom strip
+        render_buffer = getattr(self.render_local, 'buffer', None)
+        if render_buffer is None:
+            render_buffer = self.render_local.buffer = np.empty((720+LABEL_BORDER, 1280, 3), dtype=np.uint8)
+        cv2.resize(frame,(1280,720),dst=render_buffer[:720])
+        #labels and the JPEG encoder work in BGR, convert the small output frame in place
+        if self.channel_order != 'BGR':
+            cv2.cvtColor(render_buffer[:720], cv2.COLOR_RGB2BGR, dst=render_buffer[:720])
+        return write_label(render_buffer[:720],label,out=render_buffer)
 
     def encode_frame(self,frame):
         ret, buf = cv2.imencode('.jpg', frame)
         frame = buf.tobytes()
         return frame
 
+    def render_frame(self,frame,label):
+        with self.render_seconds.time():
+            frame = self.prepare_frame(frame,label)
+        with self.encode_seconds.time():
+            return self.encode_frame(frame)
+
 
     def start(self):
         self.start_flag.set()
@@ -111,42 +296,13 @@ class OutputPipe():
         with self.buffer_cv:
             self.buffer_cv.notify_all()
 
-    def start_after_delay(self, delay):
-        timer = threading.Timer(delay, self.start)
-        timer.daemon = True
-        timer.start()
-
-
     def labeled_frame_stream(self):
 
-        #timing for output fps
-        prev  = 0
-        current  = 0
-
-        #wait until there is frames to stream
-        while not self.terminate_flag.is_set():
-            if self.start_flag.wait(timeout=0.05):
-                break
-
-        #main output loop
-        while((not self.stop_flag.is_set() or len(self.buffer)) and not self.terminate_flag.is_set()):
-            while(len(self.buffer) and not self.terminate_flag.is_set()):
-                current = cv2.getTickCount()
-                time_since_last_frame = (current - prev)/ cv2.getTickFrequency()
-                if time_since_last_frame >= self.spf:
-                    self.buffer_lock.acquire(blocking=False)
-                    prev = cv2.getTickCount()
-                    try:
-                        frame = self.buffer.popleft()
-                        label = self.labels.popleft()
-                    finally:
-                        self.buffer_lock.release()
-
-                    frame = self.prepare_frame(frame,label)
-                    frame = self.encode_frame(frame)
-                    yield (b'--frame\r\n'
-                            b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+        #every viewer reads the latest frame, encoded once for all of them
+        for frame, label in self.broadcaster.subscribe(encoded=True):
+            yield (b'--frame\r\n'
+                    b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
 
         # return black frame when done
         yield (b'--frame\r\n'
-                 b'Content-Type: image/jpeg\r\n\r\n' + self.encode_frame(np.zeros((720,1280)))  + b'\r\n')
+                 b'Content-Type: image/jpeg\r\n\r\n' + self.encode_frame(np.zeros((720,1280), dtype=np.uint8))  + b'\r\n')
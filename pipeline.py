@@ -0,0 +1,175 @@
+import queue
+import threading
+import traceback
+from metrics import PIPELINE_QUEUE_CLIPS, bind_gauges, unbind_gauges
+
+END = object() # closes a stage's input queue, one per worker
+
+
+class Stage():
+    """One step of a Pipeline, `fn` runs on `workers` threads.
+
+    `fn(item)` returns the item handed to the next stage or None to drop it.
+    Results leave the stage in the order items entered it, whichever worker
+    finished first. The input queue holds at most `queue_size` items, a full
+    queue blocks the stage before it. While the next stage is full a worker
+    stores its result and waits once the stage holds one per worker.
+    """
+
+    def __init__(self, name, fn, workers = 1, queue_size = 2):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(max(1, queue_size))
+
+        self.threads = []
+        self.finished = 0
+        self.next_seq = 0    # next input sequence number to emit
+        self.results = {}    # results that finished ahead of next_seq
+        self.emitted = 0     # sequence number of the next item handed on
+        self.emitting = False # a worker is handing results on
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock) # a result was handed on
+
+
+class Pipeline():
+    """Runs `source` and a chain of stages on their own threads, connected by bounded queues.
+
+    `source()` is called repeatedly, it returns the next item, None when it
+    has nothing right now, or raises StopIteration once the input ended.
+    Overlapping stages run as fast as the slowest one and bounded queues
+    apply backpressure all the way back to the source.
+
+    `drain()` stops the source and lets every item already taken finish,
+    `abort()` stops every stage and drops whatever is still queued. `join()`
+    waits for the last stage either way. Queue depths are reported under
+    `session` while the pipeline runs.
+    """
+
+    def __init__(self, source, stages, poll = 0.1, session = 'default'):
+        self.source = source
+        self.stages = stages
+        self.poll = poll
+        self.session = session
+        self.gauges = []
+
+        self.drain_flag = threading.Event()
+        self.abort_flag = threading.Event()
+        self.error = None
+
+        self.source_thread = threading.Thread(target=self.run_source)
+        self.source_thread.daemon = True
+        for index, stage in enumerate(stages):
+            stage.threads = [threading.Thread(target=self.run_stage, args=(index,)) for _ in range(stage.workers)]
+            for thread in stage.threads:
+                thread.daemon = True
+
+    def start(self):
+        self.gauges = bind_gauges([(PIPELINE_QUEUE_CLIPS, (stage.name, self.session), stage.queue.qsize)
+                                   for stage in self.stages])
+        for stage in self.stages:
+            for thread in stage.threads:
+                thread.start()
+        self.source_thread.start()
+        return self
+
+    def drain(self):
+        self.drain_flag.set()
+
+    def abort(self):
+        self.drain_flag.set()
+        self.abort_flag.set()
+
+    def join(self):
+        self.source_thread.join()
+        for stage in self.stages:
+            for thread in stage.threads:
+                thread.join()
+        return self.error
+
+    def put(self, stage, item):
+        #blocks while the stage is busy, gives up once the pipeline is aborted
+        while not self.abort_flag.is_set():
+            try:
+                stage.queue.put(item, timeout=self.poll)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, stage):
+        while not self.abort_flag.is_set():
+            try:
+                return stage.queue.get(timeout=self.poll)
+            except queue.Empty:
+                pass
+        return END
+
+    def close(self, stage):
+        for _ in range(stage.workers):
+            self.put(stage, END)
+
+    def fail(self, name):
+        self.error = '%s failed:\n%s' % (name, traceback.format_exc())
+        print(self.error)
+        self.abort()
+
+    def run_source(self):
+        seq = 0
+        first = self.stages[0]
+        try:
+            while not self.drain_flag.is_set():
+                try:
+                    item = self.source()
+                except StopIteration:
+                    break
+                if item is not None and self.put(first, (seq, item)):
+                    seq += 1
+        except Exception:
+            self.fail('source')
+        self.close(first)
+
+    def run_stage(self, index):
+        stage = self.stages[index]
+        following = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            with stage.ready:
+                while len(stage.results) >= stage.workers and not self.abort_flag.is_set():
+                    stage.ready.wait(self.poll)
+            entry = self.get(stage)
+            if entry is END:
+                break
+            seq, item = entry
+            try:
+                result = stage.fn(item)
+            except Exception:
+                self.fail(stage.name)
+                break
+            self.emit(stage, following, seq, result)
+
+        with stage.lock:
+            stage.finished += 1
+            last = stage.finished == stage.workers
+        if last and following:
+            self.close(following)
+        elif last:
+            unbind_gauges(self.gauges)
+
+    def emit(self, stage, following, seq, result):
+        #hand results on in input order, a dropped item still takes its turn. One worker at a time hands
+        #them on outside the lock, the others only store theirs so a full next stage never holds them up
+        with stage.lock:
+            stage.results[seq] = result
+            if stage.emitting:
+                return
+            stage.emitting = True
+        while True:
+            with stage.lock:
+                if stage.next_seq not in stage.results:
+                    stage.emitting = False
+                    return
+                result = stage.results.pop(stage.next_seq)
+                stage.next_seq += 1
+                stage.ready.notify_all()
+            if result is not None and following and self.put(following, (stage.emitted, result)):
+                stage.emitted += 1
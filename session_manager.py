@@ -0,0 +1,70 @@
+import threading
+from controller import Controller
+from model.model import ViolenceModel
+
+
+class SessionManager():
+    """Runs independent capture/output pipelines on a fixed pool of loaded models.
+
+    Every session is a Controller with its own ModelConfig, prediction
+    memory and buffers. Its model is a session of the least used pooled
+    model, so the weights are loaded `pool_size` times however many sessions
+    run, and clips of concurrent sessions are batched together.
+    """
+
+    def __init__(self, pool_size = 1, max_sessions = None, max_batch_size = 8, max_wait = 0.01, **model_options):
+        self.models = [ViolenceModel(**model_options) for _ in range(pool_size)]
+        #every pooled model predicts on one scheduler thread, sessions never call the backend concurrently
+        for model in self.models:
+            model.enable_batching(max_batch_size, max_wait)
+        self.usage = [0] * pool_size
+        self.max_sessions = max_sessions
+
+        self.sessions = {} # session id -> (controller, pool index)
+        self.lock = threading.Lock()
+
+    def get(self, session_id, create = True):
+        """Returns the session's controller, creating it on the least used model unless `create` is False."""
+        with self.lock:
+            entry = self.sessions.get(session_id)
+            if entry is None:
+                if not create:
+                    return None
+                if self.max_sessions and len(self.sessions) >= self.max_sessions:
+                    raise RuntimeError('session limit of %d reached' % self.max_sessions)
+                index = self.usage.index(min(self.usage))
+                self.usage[index] += 1
+                entry = self.sessions[session_id] = (Controller(model=self.models[index].session(), session=str(session_id)), index)
+            return entry[0]
+
+    def start(self, session_id, config):
+        """Starts (or restarts) the session's pipeline, other sessions keep running."""
+        controller = self.get(session_id)
+        controller.start(config)
+        return controller
+
+    def end(self, session_id):
+        """Stops the session's pipeline, the session keeps its model for the next start."""
+        controller = self.get(session_id, create=False)
+        if controller:
+            controller.end()
+
+    def remove(self, session_id):
+        with self.lock:
+            entry = self.sessions.pop(session_id, None)
+            if entry:
+                self.usage[entry[1]] -= 1
+        if entry:
+            controller = entry[0]
+            controller.end()
+            controller.model.release()
+
+    def session_ids(self):
+        with self.lock:
+            return list(self.sessions)
+
+    def close(self):
+        for session_id in self.session_ids():
+            self.remove(session_id)
+        for model in self.models:
+            model.release()
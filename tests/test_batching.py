@@ -0,0 +1,104 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from model.batching import BatchScheduler
+
+
+class RecordingPredict():
+    """Scores every clip with its mean and remembers the batch sizes it got."""
+
+    def __init__(self, delay = 0.):
+        self.batches = []
+        self.delay = delay
+        self.lock = threading.Lock()
+
+    def __call__(self, batch):
+        with self.lock:
+            self.batches.append(batch.shape)
+        time.sleep(self.delay)
+        means = batch.reshape(len(batch), -1).mean(axis=1)
+        return np.stack([means, -means], axis=1)
+
+
+def clip(value, frames = 4):
+    return np.full((frames, 2, 2, 3), value, dtype=np.uint8)
+
+
+def test_full_batch_runs_without_waiting():
+    predict = RecordingPredict()
+    scheduler = BatchScheduler(predict, max_batch_size=4, max_wait=5).start()
+    try:
+        started = time.perf_counter()
+        futures = [scheduler.submit(clip(i)) for i in range(4)]
+        scores = [future.result(timeout=2) for future in futures]
+        assert time.perf_counter() - started < 1
+        assert predict.batches == [(4, 4, 2, 2, 3)]
+        assert [score[0] for score in scores] == [0, 1, 2, 3]
+    finally:
+        scheduler.stop()
+
+
+def test_partial_batch_waits_for_max_wait():
+    predict = RecordingPredict()
+    scheduler = BatchScheduler(predict, max_batch_size=8, max_wait=0.2).start()
+    try:
+        started = time.perf_counter()
+        futures = [scheduler.submit(clip(i)) for i in range(3)]
+        for future in futures:
+            future.result(timeout=2)
+        assert time.perf_counter() - started >= 0.15
+        assert predict.batches == [(3, 4, 2, 2, 3)]
+    finally:
+        scheduler.stop()
+
+
+def test_clip_sizes_never_share_a_batch():
+    predict = RecordingPredict()
+    scheduler = BatchScheduler(predict, max_batch_size=8, max_wait=0.05).start()
+    try:
+        futures = [scheduler.submit(clip(i, frames=4 if i % 2 else 8)) for i in range(6)]
+        scores = [future.result(timeout=2) for future in futures]
+        assert sorted(predict.batches) == [(3, 4, 2, 2, 3), (3, 8, 2, 2, 3)]
+        assert [score[0] for score in scores] == list(range(6))
+    finally:
+        scheduler.stop()
+
+
+def test_predict_errors_reach_every_clip_of_the_batch():
+    def failing(batch):
+        raise ValueError('bad batch')
+
+    scheduler = BatchScheduler(failing, max_batch_size=2, max_wait=0.01).start()
+    try:
+        futures = [scheduler.submit(clip(i)) for i in range(2)]
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result(timeout=2)
+    finally:
+        scheduler.stop()
+
+
+def test_concurrency_runs_batches_in_parallel():
+    predict = RecordingPredict(delay=0.2)
+    scheduler = BatchScheduler(predict, max_batch_size=1, max_wait=0.001, concurrency=4).start()
+    try:
+        started = time.perf_counter()
+        futures = [scheduler.submit(clip(i)) for i in range(4)]
+        for future in futures:
+            future.result(timeout=2)
+        assert time.perf_counter() - started < 0.6
+    finally:
+        scheduler.stop()
+
+
+def test_stop_fails_pending_clips():
+    scheduler = BatchScheduler(RecordingPredict(), max_batch_size=8, max_wait=0.01)
+    future = scheduler.submit(clip(0))
+    scheduler.stop()
+    with pytest.raises(RuntimeError):
+        future.result(timeout=1)
+    with pytest.raises(RuntimeError):
+        scheduler.submit(clip(1))
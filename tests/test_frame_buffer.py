@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from frame_buffer import FrameBuffer, DROP_OLDEST, DROP_NEWEST
+
+
+def frame(index):
+    return np.full((2, 2, 3), index, dtype=np.uint8)
+
+
+def indices(clip):
+    return [int(f[0, 0, 0]) for f in clip]
+
+
+def test_drop_oldest_after_release_keeps_newest_frames():
+    buffer = FrameBuffer(capacity=8, window=4, overflow=DROP_OLDEST)
+    for i in range(4):
+        buffer.push(frame(i))
+    assert indices(buffer.read(4, hop=2)) == [0, 1, 2, 3]
+    buffer.release()
+
+    #the overlap frames 2 and 3 were handed out already, dropping them loses nothing
+    assert all(buffer.push(frame(i)) for i in range(4, 12))
+    assert buffer.dropped == 0
+    assert all(buffer.push(frame(i)) for i in range(12, 14))
+    assert buffer.dropped == 2
+
+    assert indices(buffer.read(4, hop=2)) == [6, 7, 8, 9]
+    assert buffer.overlap == 0
+
+
+def test_drop_oldest_skips_to_newest_frames_while_view_is_held():
+    buffer = FrameBuffer(capacity=8, window=4, overflow=DROP_OLDEST)
+    for i in range(4):
+        buffer.push(frame(i))
+    assert indices(buffer.read(4, hop=2)) == [0, 1, 2, 3]
+
+    #the ring fills up behind the held view, later frames cannot get a slot yet
+    accepted = [buffer.push(frame(i)) for i in range(4, 12)]
+    assert accepted == [True] * 4 + [False] * 4
+
+    #the next read catches up instead of returning the stale overlap, only refused frames were lost
+    assert indices(buffer.read(4, hop=2)) == [4, 5, 6, 7]
+    assert buffer.overlap == 0
+    assert buffer.dropped == 4
+
+    #room was made for new frames
+    assert buffer.push(frame(12))
+
+
+def test_drop_newest_keeps_reading_in_order():
+    buffer = FrameBuffer(capacity=8, window=4, overflow=DROP_NEWEST)
+    for i in range(4):
+        buffer.push(frame(i))
+    buffer.read(4, hop=2)
+    for i in range(4, 12):
+        buffer.push(frame(i))
+    assert indices(buffer.read(4, hop=2)) == [2, 3, 4, 5]
+    assert buffer.overlap == 2
+
+
+def test_drop_oldest_without_view():
+    buffer = FrameBuffer(capacity=4, window=4, overflow=DROP_OLDEST)
+    for i in range(6):
+        assert buffer.push(frame(i))
+    assert indices(buffer.read(4)) == [2, 3, 4, 5]
+    assert buffer.dropped == 2
+
+
+@pytest.mark.parametrize('hop', [0, -1, 5])
+def test_read_rejects_bad_hop(hop):
+    buffer = FrameBuffer(capacity=8, window=4)
+    buffer.push(frame(0))
+    with pytest.raises(ValueError):
+        buffer.read(4, hop=hop)
@@ -0,0 +1,44 @@
+import pytest
+
+from jitter_buffer import JitterBuffer
+
+
+def test_no_target_before_the_first_clip():
+    jitter = JitterBuffer(fps=30)
+    assert not jitter.ready(100)
+    assert jitter.frame_interval(0) == pytest.approx(1/30)
+
+
+def test_target_covers_the_slow_clips():
+    jitter = JitterBuffer(fps=30, percentile=100)
+    for seconds in (0.5, 0.5, 0.5, 1.0):
+        jitter.observe(seconds, 32)
+    #clips come faster than they play, the slowest one takes 30 frames at 30 fps to ride out
+    assert jitter.interval == pytest.approx(1/30)
+    assert jitter.target == 30
+    assert not jitter.ready(29)
+    assert jitter.ready(30)
+
+
+def test_interval_follows_slow_production():
+    jitter = JitterBuffer(fps=30)
+    jitter.observe(2.0, 32)
+    assert jitter.interval == pytest.approx(2.0 / 32)
+    assert jitter.delay(10) == pytest.approx(10 * 2.0 / 32)
+
+
+def test_playback_slows_down_below_target():
+    jitter = JitterBuffer(fps=30, percentile=100, max_adjust=0.1)
+    jitter.observe(1.0, 32)
+    assert jitter.frame_interval(jitter.target) == pytest.approx(1/30)
+    assert jitter.frame_interval(0) == pytest.approx(1/30 * 1.1)
+    assert 1/30 < jitter.frame_interval(jitter.target // 2) < 1/30 * 1.1
+
+
+def test_catch_up_only_for_live_sources():
+    live = JitterBuffer(fps=30, percentile=100, max_adjust=0.1)
+    playback = JitterBuffer(fps=30, percentile=100, max_adjust=0.1, catch_up=False)
+    for jitter in (live, playback):
+        jitter.observe(1.0, 32)
+    assert live.frame_interval(3 * live.target) == pytest.approx(1/30 * 0.9)
+    assert playback.frame_interval(3 * playback.target) == pytest.approx(1/30)
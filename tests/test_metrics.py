@@ -0,0 +1,86 @@
+import urllib.request
+
+import pytest
+
+from metrics import MetricsRegistry, bind_gauges, unbind_gauges, start_http_server
+
+
+def lines(registry):
+    return registry.exposition().splitlines()
+
+
+def test_counter_exposition():
+    registry = MetricsRegistry()
+    frames = registry.counter('frames', 'Frames seen', ('stage',))
+    frames.labels('capture').inc()
+    frames.labels('capture').inc(2)
+    frames.labels('say "hi"\\').inc()
+    assert lines(registry) == [
+        '# HELP frames Frames seen',
+        '# TYPE frames counter',
+        'frames_total{stage="capture"} 3',
+        'frames_total{stage="say \\"hi\\"\\\\"} 1',
+    ]
+    with pytest.raises(ValueError):
+        frames.labels('capture').inc(-1)
+    with pytest.raises(ValueError):
+        frames.labels('capture', 'extra')
+
+
+def test_unlabelled_metrics_are_always_exported():
+    registry = MetricsRegistry()
+    registry.counter('clips', 'Clips')
+    registry.gauge('delay', 'Delay')
+    assert 'clips_total 0' in lines(registry)
+    assert 'delay 0' in lines(registry)
+
+
+def test_histogram_exposition():
+    registry = MetricsRegistry()
+    seconds = registry.histogram('seconds', 'Seconds', buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        seconds.observe(value)
+    assert lines(registry)[2:] == [
+        'seconds_bucket{le="0.1"} 1',
+        'seconds_bucket{le="1"} 3',
+        'seconds_bucket{le="+Inf"} 4',
+        'seconds_sum 6.05',
+        'seconds_count 4',
+    ]
+
+
+def test_gauge_functions_and_unbind():
+    registry = MetricsRegistry()
+    fps = registry.gauge('fps', 'FPS', ('stage', 'session'))
+    gauges = bind_gauges([(fps, ('capture', 'a'), lambda: 25.0), (fps, ('output', 'a'), lambda: 1 / 0)])
+    assert 'fps{stage="capture",session="a"} 25.0' in lines(registry)
+    assert 'fps{stage="output",session="a"} NaN' in lines(registry)
+
+    #a newer owner of the same labels keeps its child when the old one unbinds
+    newer = bind_gauges([(fps, ('capture', 'a'), lambda: 30.0)])
+    unbind_gauges(gauges)
+    assert lines(registry)[2:] == ['fps{stage="capture",session="a"} 30.0']
+    unbind_gauges(newer)
+    assert lines(registry)[2:] == []
+
+
+def test_registry_rejects_conflicting_metrics():
+    registry = MetricsRegistry()
+    first = registry.counter('frames', 'Frames', ('stage',))
+    assert registry.counter('frames', 'Frames', ('stage',)) is first
+    with pytest.raises(ValueError):
+        registry.gauge('frames', 'Frames', ('stage',))
+
+
+def test_http_endpoint_serves_the_registry():
+    registry = MetricsRegistry()
+    registry.counter('clips', 'Clips').inc(5)
+    server = start_http_server(0, registry=registry)
+    try:
+        url = 'http://127.0.0.1:%d/metrics' % server.server_address[1]
+        with urllib.request.urlopen(url, timeout=2) as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            assert 'clips_total 5' in response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,98 @@
+import random
+import threading
+import time
+
+from metrics import REGISTRY
+from pipeline import Pipeline, Stage
+
+
+def counting_source(count):
+    items = iter(range(count))
+
+    def source():
+        return next(items)
+    return source
+
+
+def test_results_keep_input_order_across_workers():
+    out = []
+
+    def work(item):
+        time.sleep(random.random() * 0.005)
+        #every seventh item is dropped but still takes its turn
+        return None if item % 7 == 3 else item
+
+    pipeline = Pipeline(counting_source(100), [Stage('work', work, workers=4),
+                                               Stage('out', out.append, queue_size=1)])
+    assert pipeline.start().join() is None
+    assert out == [item for item in range(100) if item % 7 != 3]
+
+
+def test_source_without_items_is_polled_again():
+    items = [None, 1, None, None, 2]
+    out = []
+
+    def source():
+        if not items:
+            raise StopIteration
+        return items.pop(0)
+
+    Pipeline(source, [Stage('out', out.append)]).start().join()
+    assert out == [1, 2]
+
+
+def test_stage_error_aborts_the_pipeline():
+    seen = []
+
+    def work(item):
+        if item == 5:
+            raise ValueError('bad item')
+        return item
+
+    pipeline = Pipeline(counting_source(1000), [Stage('work', work, workers=2), Stage('out', seen.append)])
+    error = pipeline.start().join()
+    assert 'work failed' in error and 'bad item' in error
+    assert pipeline.abort_flag.is_set()
+    assert 5 not in seen
+
+
+def test_full_stage_holds_back_the_source():
+    taken = []
+    release = threading.Event()
+
+    def source():
+        taken.append(len(taken))
+        return taken[-1]
+
+    pipeline = Pipeline(source, [Stage('work', lambda item: item, workers=2, queue_size=1),
+                                 Stage('out', lambda item: release.wait(), queue_size=1)])
+    pipeline.start()
+    time.sleep(0.3)
+    #a bounded number of items is in flight: queues, workers and their pending results
+    assert len(taken) < 10
+    pipeline.abort()
+    release.set()
+    pipeline.join()
+
+
+def test_drain_finishes_items_already_taken():
+    out = []
+    pipeline = Pipeline(lambda: 1, [Stage('work', lambda item: item, workers=2), Stage('out', out.append)])
+    pipeline.start()
+    time.sleep(0.05)
+    pipeline.drain()
+    assert pipeline.join() is None
+    count = len(out)
+    assert count > 0
+    time.sleep(0.05)
+    assert len(out) == count
+
+
+def test_queue_gauges_are_labelled_by_session_while_running():
+    release = threading.Event()
+    pipeline = Pipeline(counting_source(3), [Stage('wait', lambda item: release.wait())], session='s7')
+    pipeline.start()
+    assert 'rtvd_pipeline_queue_clips{stage="wait",session="s7"}' in REGISTRY.exposition()
+    release.set()
+    pipeline.join()
+    assert 'session="s7"' not in REGISTRY.exposition()
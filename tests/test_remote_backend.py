@@ -0,0 +1,142 @@
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from model.backends import InferenceBackend
+from model.remote_backend import InferenceServer, RemoteBackend, HEADER_SIZE, recv_message
+
+FRAME_DIMS = (8, 8, 3)
+
+
+class StubBackend(InferenceBackend):
+    """Scores a clip with its mean pixel value and the id of the worker that ran it."""
+
+    def __init__(self, worker_id, delay = 0.):
+        super().__init__(FRAME_DIMS, True, 2)
+        self.worker_id = worker_id
+        self.delay = delay
+        self.started = threading.Event()
+
+    def load(self):
+        pass
+
+    def infer(self, batch):
+        self.started.set()
+        time.sleep(self.delay)
+        means = batch.reshape(len(batch), -1).mean(axis=1)
+        return np.stack([means, np.full(len(batch), self.worker_id)], axis=1)
+
+
+def start_server(backend):
+    return InferenceServer(backend, '127.0.0.1', 0, max_wait=0.001).start()
+
+
+def address(server):
+    return '%s:%d' % server.address
+
+
+def clips(count, value = 7):
+    return np.full((count, 4, *FRAME_DIMS), value, dtype=np.uint8)
+
+
+@pytest.fixture
+def servers():
+    started = []
+    yield started
+    for server in started:
+        server.shutdown()
+
+
+def test_round_trip(servers):
+    servers.append(start_server(StubBackend(1)))
+    remote = RemoteBackend(FRAME_DIMS, workers=[address(servers[0])], heartbeat=0.1)
+    remote.load()
+    try:
+        remote.warm_up(4)
+        scores = remote.infer(clips(3, value=9))
+        assert scores.shape == (3, 2)
+        assert np.allclose(scores[:, 0], 9)
+        assert np.all(scores[:, 1] == 1)
+    finally:
+        remote.release()
+
+
+def test_failover_when_worker_dies(servers):
+    slow = StubBackend(1, delay=0.5)
+    servers.append(start_server(slow))
+    servers.append(start_server(StubBackend(2)))
+    remote = RemoteBackend(FRAME_DIMS, workers=[address(server) for server in servers], heartbeat=0.1)
+    remote.load()
+    try:
+        result = {}
+        thread = threading.Thread(target=lambda: result.setdefault('scores', remote.infer(clips(1))))
+        thread.start()
+        #the batch is running on the first worker when it goes away
+        assert slow.started.wait(2)
+        servers[0].shutdown()
+        servers.pop(0)
+        thread.join(5)
+        assert result['scores'][0, 1] == 2
+
+        assert not remote.connections[0].alive
+        assert remote.infer(clips(2))[:, 1].tolist() == [2, 2]
+    finally:
+        remote.release()
+
+
+def test_no_worker_reachable():
+    with socket.socket() as unused:
+        unused.bind(('127.0.0.1', 0))
+        port = unused.getsockname()[1]
+    remote = RemoteBackend(FRAME_DIMS, workers=['127.0.0.1:%d' % port], connect_timeout=0.5)
+    with pytest.raises(RuntimeError):
+        remote.load()
+
+
+def test_server_closes_oversized_message(servers):
+    servers.append(start_server(StubBackend(1)))
+    sock = socket.create_connection(servers[0].address, timeout=2)
+    try:
+        recv_message(sock)
+        header = b'{"type": "infer", "id": 1, "nbytes": 1099511627776, "shape": [1], "dtype": "|u1"}'
+        sock.sendall(HEADER_SIZE.pack(len(header)) + header)
+        assert sock.recv(1) == b''
+    finally:
+        sock.close()
+
+
+def test_server_closes_mismatched_array(servers):
+    servers.append(start_server(StubBackend(1)))
+    sock = socket.create_connection(servers[0].address, timeout=2)
+    try:
+        recv_message(sock)
+        header = b'{"type": "infer", "id": 1, "nbytes": 4, "shape": [1000, 4, 8, 8, 3], "dtype": "|u1"}'
+        sock.sendall(HEADER_SIZE.pack(len(header)) + header + struct.pack('!I', 0))
+        assert sock.recv(1) == b''
+    finally:
+        sock.close()
+
+
+def test_reconnects_when_worker_is_back(servers):
+    servers.append(start_server(StubBackend(1)))
+    port = servers[0].address[1]
+    remote = RemoteBackend(FRAME_DIMS, workers=[address(servers[0])], heartbeat=0.05)
+    remote.load()
+    try:
+        servers.pop().shutdown()
+        deadline = time.monotonic() + 2
+        while remote.connections[0].alive and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert not remote.connections[0].alive
+
+        servers.append(InferenceServer(StubBackend(3), '127.0.0.1', port, max_wait=0.001).start())
+        deadline = time.monotonic() + 2
+        while not remote.connections[0].alive and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert remote.infer(clips(1))[0, 1] == 3
+    finally:
+        remote.release()
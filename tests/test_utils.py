@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from utils import P2Quantile, PerformanceTimer
+
+
+@pytest.mark.parametrize('q', [0.5, 0.95, 0.99])
+@pytest.mark.parametrize('distribution', ['uniform', 'exponential', 'normal'])
+def test_p2_quantile_tracks_numpy(q, distribution):
+    rng = np.random.default_rng(7)
+    values = getattr(rng, distribution)(size=20000)
+    quantile = P2Quantile(q)
+    for value in values:
+        quantile.add(value)
+    exact = np.percentile(values, q * 100)
+    spread = np.percentile(values, 99.9) - np.percentile(values, 0.1)
+    assert abs(quantile.value() - exact) < 0.02 * spread
+
+
+def test_p2_quantile_with_few_values():
+    quantile = P2Quantile(0.5)
+    assert quantile.value() == 0
+    for value in (3, 1, 2):
+        quantile.add(value)
+    assert quantile.value() == 2
+
+
+def test_performance_timer_statistics():
+    timer = PerformanceTimer(window=10)
+    assert timer.getFramerate() == 0
+    for _ in range(200):
+        timer.add(0.1)
+    assert timer.averageTime() == pytest.approx(0.1)
+    assert timer.percentile(95) == pytest.approx(0.1)
+    assert len(timer.records) == 10
+    assert timer.count == 200
+    assert timer.getFramerate(32) == pytest.approx(320, abs=1)
@@ -0,0 +1,93 @@
+import json
+import threading
+import time
+from metrics import FRAME_LATENCY
+
+#stage entries in the order a frame goes through them, times come from time.perf_counter
+CAPTURE = 'capture'
+CLASSIFY = 'classify'
+OUTPUT = 'output'
+RENDER = 'render'
+EMIT = 'emit'
+STAGES = (CAPTURE, CLASSIFY, OUTPUT, RENDER, EMIT)
+
+#trace span names, the span ends where the next stage is entered
+SPANS = {CAPTURE: 'capture queue', CLASSIFY: 'classify', OUTPUT: 'playout queue', RENDER: 'render'}
+
+
+class ClipTrace():
+    """Capture times of the new frames of one clip and the times the clip entered later stages.
+
+    `first_index` is the stream index of the first frame, frames keep their
+    own capture time while clip wide stages are shared by all of them.
+    """
+
+    def __init__(self, first_index, captured):
+        self.first_index = first_index
+        self.captured = captured
+        self.stages = {}
+
+    def enter(self, stage, at=None):
+        self.stages[stage] = time.perf_counter() if at is None else at
+
+    def frame_stages(self, i, **frame_stages):
+        stages = {CAPTURE: self.captured[i]}
+        stages.update(self.stages)
+        stages.update(frame_stages)
+        return stages
+
+
+class LatencyTracer():
+    """Exports per-frame latency from capture to every later stage.
+
+    Every frame feeds the `rtvd_frame_latency_seconds` histograms. With a
+    `trace_path`, every `sample_every`-th frame is also kept as a row of
+    spans and written in Chrome trace-event JSON (chrome://tracing or
+    Perfetto) once the stream ends, up to `max_frames` frames.
+    """
+
+    def __init__(self, trace_path=None, sample_every=100, max_frames=1000):
+        self.trace_path = trace_path
+        self.sample_every = max(1, sample_every)
+        self.max_frames = max_frames
+        self.origin = time.perf_counter()
+
+        self.latency = {stage: FRAME_LATENCY.labels(stage) for stage in STAGES[1:]}
+        self.events = []
+        self.sampled = 0
+        self.lock = threading.Lock()
+
+    def frame_done(self, trace, i, **frame_stages):
+        """Records frame `i` of `trace` with its own per-frame stage entries."""
+        stages = trace.frame_stages(i, **frame_stages)
+        captured = stages[CAPTURE]
+        for stage in STAGES[1:]:
+            if stage in stages:
+                self.latency[stage].observe(stages[stage] - captured)
+
+        index = trace.first_index + i
+        if self.trace_path and index % self.sample_every == 0 and self.sampled < self.max_frames:
+            self.sample(index, stages)
+
+    def sample(self, index, stages):
+        entered = [(stage, stages[stage]) for stage in STAGES if stage in stages]
+        events = [{'name': SPANS.get(stage, stage), 'cat': 'frame', 'ph': 'X', 'pid': 1, 'tid': index,
+                   'ts': self.micros(start), 'dur': round((end - start) * 1e6, 1),
+                   'args': {'frame': index}}
+                  for (stage, start), (_, end) in zip(entered, entered[1:])]
+        #names the frame's row in the viewer
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': index, 'args': {'name': 'frame %d' % index}})
+        with self.lock:
+            self.events.extend(events)
+            self.sampled += 1
+
+    def micros(self, seconds):
+        return round((seconds - self.origin) * 1e6, 1)
+
+    def write(self):
+        if not self.trace_path:
+            return
+        with self.lock:
+            events = list(self.events)
+        with open(self.trace_path, 'w') as trace_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file)
@@ -2,6 +2,8 @@ import cv2
 import os
 import numpy as np
 from datetime import datetime
+from collections import OrderedDict, deque
+import threading
 
 def anotate_clip(clip,label):
     out_clip = []
@@ -9,24 +11,65 @@ def anotate_clip(clip,label):
         out_clip.append(write_label(frame,label))
     return  out_clip
 
-def write_label(frame, prediction):
+LABEL_BORDER = 10
+LABEL_STRIP = 32 # rows above the border the banner can draw over
+LABEL_CACHE_SIZE = 64
+label_sprites = OrderedDict()
+label_sprites_lock = threading.Lock()
 
+def write_label(frame, prediction, out=None):
+    """Returns frame with the label banner and a bottom border of LABEL_BORDER rows.
+
+    The banner is drawn once per (label, score, width) and composited on
+    the bottom strip. `out` may be a preallocated `(h+LABEL_BORDER,w,3)`
+    array, if `frame` already is its top rows nothing is copied.
+    """
     height,width = frame.shape[0], frame.shape[1]
+    if out is None:
+        out = np.empty((height+LABEL_BORDER, width, 3), dtype=np.uint8)
+    if not np.shares_memory(out, frame):
+        out[:height] = frame
+
+    sprite, mask = label_sprite(prediction['label'], prediction['score'], width)
+    rows = min(len(sprite), height+LABEL_BORDER)
+    np.copyto(out[-rows:], sprite[-rows:], where=mask[-rows:])
+    return out
+
+def label_sprite(label, score, width):
+    key = (label, score, width)
+    with label_sprites_lock:
+        if key in label_sprites:
+            label_sprites.move_to_end(key)
+            return label_sprites[key]
+
+    canvas = np.zeros((LABEL_STRIP+LABEL_BORDER, width, 3), dtype=np.uint8)
+    mask = np.zeros((LABEL_STRIP+LABEL_BORDER, width), dtype=np.uint8)
+    #the mask gets the same drawing in white to mark the pixels the banner covers
+    draw_label(canvas, label, score, width, LABEL_STRIP)
+    draw_label(mask, label, score, width, LABEL_STRIP, mask=True)
+    sprite = (canvas, mask[..., None].astype(bool))
+
+    with label_sprites_lock:
+        label_sprites[key] = sprite
+        if len(label_sprites) > LABEL_CACHE_SIZE:
+            label_sprites.popitem(last=False)
+    return sprite
+
+def draw_label(frame, label, score, width, height, mask=False):
     midX = width//2
 
     borderColor = (69,209,14)
 
-    if prediction['label'].lower() == 'violence':
+    if label.lower() == 'violence':
         borderColor =  (36,28,236)
 
+    outlineColor = (0,0,0)
+    font_color =(255, 255, 255)
+    if mask:
+        borderColor = outlineColor = font_color = 255
+
     #### Bottom Border  ####
-    frame = cv2.copyMakeBorder(frame,
-        top=0,
-        bottom=10,
-        left=0,
-        right=0,
-        borderType=cv2.BORDER_CONSTANT,
-        value=[*borderColor])
+    frame[height:] = borderColor
 
     ####   polygon   ####
     vrx = np.array((
@@ -36,7 +79,7 @@ def write_label(frame, prediction):
                     [(midX+120),height]),
                    np.int32)
     vrx = vrx.reshape((-1,1,2))
-    frame = cv2.polylines(frame, [vrx], False, (0,0,0),2)
+    cv2.polylines(frame, [vrx], False, outlineColor,2)
     cv2.fillPoly(frame, pts = [vrx], color =borderColor)
     ###############################
 
@@ -44,9 +87,8 @@ def write_label(frame, prediction):
     text_location = (midX-90,height)
     font = cv2.FONT_HERSHEY_DUPLEX
     font_scale = 0.6
-    font_color =(255, 255, 255)
     lineType= 2
-    outText = prediction['label']+' '+str(prediction['score'])+'%'
+    outText = label+' '+str(score)+'%'
     cv2.putText(frame,
                 outText,
                 text_location,
@@ -56,31 +98,118 @@ def write_label(frame, prediction):
                 lineType,)
     ##############################
 
-    return frame
+
+class P2Quantile():
+    """Streaming estimate of one quantile in constant memory and time.
+
+    Uses the P-square algorithm (Jain & Chlamtac, 1985): five markers
+    are nudged towards their ideal positions with a piecewise parabolic
+    fit instead of keeping the observations.
+    """
+    def __init__(self, q):
+        self.q = q
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1+2*q, 1+4*q, 3+2*q, 5]
+        self.increments = [0, q/2, q, (1+q)/2, 1]
+
+    def add(self, x):
+        h = self.heights
+        if len(h) < 5:
+            h.append(x)
+            h.sort()
+            return
+
+        if x < h[0]:
+            h[0] = x
+            k = 0
+        elif x >= h[4]:
+            h[4] = x
+            k = 3
+        else:
+            k = 0
+            while not h[k] <= x < h[k+1]:
+                k += 1
+
+        n = self.positions
+        for i in range(k+1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i+1] - n[i] > 1) or (d <= -1 and n[i-1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self.parabolic(i, d)
+                if not h[i-1] < height < h[i+1]:
+                    height = h[i] + d*(h[i+d] - h[i])/(n[i+d] - n[i])
+                h[i] = height
+                n[i] += d
+
+    def parabolic(self, i, d):
+        h, n = self.heights, self.positions
+        return h[i] + d/(n[i+1] - n[i-1]) * ((n[i] - n[i-1] + d)*(h[i+1] - h[i])/(n[i+1] - n[i]) +
+                                              (n[i+1] - n[i] - d)*(h[i] - h[i-1])/(n[i] - n[i-1]))
+
+    def value(self):
+        if not self.heights:
+            return 0
+        if len(self.heights) < 5:
+            return self.heights[int(round(self.q*(len(self.heights)-1)))]
+        return self.heights[2]
 
 
 class PerformanceTimer():
-    def __init__(self) -> None:
+    """Times intervals between `record` calls in O(1) time and memory.
+
+    The average is an exponentially weighted moving average over roughly
+    the last `window` records, `records` only keeps that many recent
+    intervals and p50/p95/p99 are streaming P-square estimates.
+    """
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self, window = 100) -> None:
         self.previous = 0
         self.current = 0
         self.lastRecord = 0
-        self.records = []
+        self.records = deque(maxlen=window)
+        self.count = 0
+        self.alpha = 2/(window+1)
+        self.average = 0
+        self.quantiles = {p: P2Quantile(p/100) for p in PerformanceTimer.PERCENTILES}
 
     def record(self):
         self.current = cv2.getTickCount()
         if self.previous:
             self.lastRecord = (self.current - self.previous)/ cv2.getTickFrequency()
-            self.records.append(self.lastRecord)
+            self.add(self.lastRecord)
         self.previous = self.current
 
+    def add(self, seconds):
+        self.records.append(seconds)
+        self.count += 1
+        if self.count == 1:
+            self.average = seconds
+        else:
+            self.average += self.alpha*(seconds - self.average)
+        for quantile in self.quantiles.values():
+            quantile.add(seconds)
+
     def averageTime(self):
-        return sum(self.records)/len(self.records)
+        return self.average
+
+    def percentile(self, p):
+        return self.quantiles[p].value()
+
+    def percentiles(self):
+        return {p: quantile.value() for p, quantile in self.quantiles.items()}
 
     def timePerFrame(self,framesPerRecord):
         return ( self.averageTime() / framesPerRecord )
 
     def getFramerate(self,framesPerRecord = 1):
-        if not len(self.records):
+        if not self.count or not self.average:
             return 0
         return ( framesPerRecord//self.averageTime() )
 
@@ -98,7 +227,7 @@ class PerformanceTimer():
         return (cv2.getTickCount() - self.startingTime) / cv2.getTickFrequency()
 
     def hasRecords(self, n=1):
-        return len(self.records) == n
+        return self.count == n
 
 
 
@@ -1,24 +1,45 @@
 import cv2
-from collections import deque
 import threading
+import time
 from utils import PerformanceTimer
+from frame_buffer import FrameBuffer, DROP_OLDEST
+from tracing import ClipTrace
+from motion import MotionEnergy
+from metrics import STAGE_SECONDS, FRAMES, DROPPED_FRAMES, QUEUE_FRAMES, BUFFER_BYTES, FPS, bind_gauges, unbind_gauges
 
 class VideoCapture():
 
-    def __init__(self, video_src, trigger_mode=False):
+    def __init__(self, video_src, trigger_mode=False, clip_size=32, buffer_clips=4, overflow=DROP_OLDEST, stride=1,
+                 measure_motion=False, session='default'):
         self.trigger_mode = trigger_mode
+        # frames are stored in the source's own order: OpenCV decodes BGR, the webcam component sends RGB
+        self.channel_order = 'RGB' if trigger_mode else 'BGR'
+        # keep every stride-th source frame, the rest are grabbed but never decoded
+        self.stride = max(1, stride)
+        self.frame_index = 0
+        # motion energy of every kept frame, lets static clips skip inference
+        self.motion = MotionEnergy() if measure_motion else None
 
         self.cap = self.open_cap(video_src or 0)
-        self.buffer = deque([])
+        self.buffer = FrameBuffer(capacity=clip_size*buffer_clips, window=clip_size, overflow=overflow)
 
         self.stop_flag = threading.Event()
-        self.buffer_lock = threading.Lock()
-        self.buffer_cv = threading.Condition(self.buffer_lock)
 
         self.capture_thread = threading.Thread(target=self.capture)
 
         self.fpsRecord = PerformanceTimer()
 
+        self.decode_seconds = STAGE_SECONDS.labels('decode')
+        self.captured_frames = FRAMES.labels('capture')
+        self.dropped_frames = DROPPED_FRAMES.labels('capture')
+        self.reported_drops = 0
+        #read at scrape time until the capture stops, session tells concurrent streams apart
+        self.gauges = bind_gauges([
+            (QUEUE_FRAMES, ('capture', session), lambda: len(self.buffer)),
+            (BUFFER_BYTES, ('capture', session), lambda: self.buffer.slab.nbytes if self.buffer.slab is not None else 0),
+            (FPS, ('capture', session), self.getFPS),
+        ])
+
     def isPlaying(self):
         if self.trigger_mode:
             return True
@@ -29,43 +50,94 @@ class VideoCapture():
 
         while(self.isPlaying() and not self.stop_flag.is_set()):
 
-            ret, frame = self.cap.read()
+            start = time.perf_counter()
+            if not self.cap.grab():
+                break
+            if self.skip_frame():
+                continue
+            captured = time.perf_counter()
+            grab_seconds = captured - start
+
+            #first frame sizes the ring, the rest decode straight into their slot
+            if self.buffer.frame_shape is None:
+                start = time.perf_counter()
+                ret, frame = self.cap.retrieve()
+                decode_seconds = grab_seconds + time.perf_counter() - start
+                if ret == True and self.buffer.push(frame, timestamp=captured, motion=self.measure(frame)):
+                    self.frame_captured(decode_seconds)
+                continue
+
+            slot = self.buffer.reserve(self.buffer.frame_shape)
+            self.count_dropped()
+            if slot is None:
+                if self.buffer.closed:
+                    break
+                continue
+
+            start = time.perf_counter()
+            ret, frame = self.cap.retrieve(slot)
             if ret == True:
-                with self.buffer_cv:
-                        self.buffer.append(frame)
-                        self.fpsRecord.record()
-                        self.buffer_cv.notify_all()
+                decode_seconds = grab_seconds + time.perf_counter() - start
+                self.buffer.commit(frame, captured, self.measure(frame))
+                self.frame_captured(decode_seconds)
             else:
                 break
         self.cap.release()
-        with self.buffer_cv:
-            self.buffer_cv.notify_all()
-
-    def trigger_capture(self, frame):
-        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)#TODO move this to model code
-        with self.buffer_cv:
-            self.buffer.append(frame)
-            self.fpsRecord.record()
-            self.buffer_cv.notify_all()
-
-    def read_clip(self,clip_size):
-        clip = []
+        self.buffer.close()
 
-        with self.buffer_cv:
-            # if reading is lagging wait for buffer to fill up. unless capture has ended
-            while(len(self.buffer) < clip_size and self.isPlaying() and not self.stop_flag.is_set()):
-                self.buffer_cv.wait(timeout=0.01)
+    def skip_frame(self):
+        skip = self.frame_index % self.stride != 0
+        self.frame_index += 1
+        return skip
 
+    def trigger_capture(self, frame):
+        captured = time.perf_counter()
+        if self.skip_frame():
+            return
+        slot = self.buffer.reserve(frame.shape)
+        self.count_dropped()
+        if slot is None:
+            return
+        self.buffer.commit(frame, captured, self.measure(frame))
+        self.frame_captured()
+
+    def measure(self, frame):
+        return self.motion.measure(frame) if self.motion else 0.
+
+    def frame_captured(self, decode_seconds=None):
+        if decode_seconds is not None:
+            self.decode_seconds.observe(decode_seconds)
+        self.captured_frames.inc()
+        self.fpsRecord.record()
+
+    def count_dropped(self):
+        dropped = self.buffer.dropped
+        if dropped > self.reported_drops:
+            self.dropped_frames.inc(dropped - self.reported_drops)
+            self.reported_drops = dropped
+
+    def read_clip(self,clip_size,hop=None):
+        # if reading is lagging wait for buffer to fill up. unless capture has ended
+        return self.buffer.read(clip_size, hop=hop, is_live=lambda: self.isPlaying() and not self.stop_flag.is_set())
+
+    def release_clip(self):
+        #the last clip was copied, its frames may be overwritten
+        self.buffer.release()
+
+    def new_frames(self):
+        #range of the last clip that was not part of the clip before it
+        return self.buffer.overlap, self.buffer.available
+
+    def clip_motion(self):
+        #strongest motion within the last clip, None when motion is not measured
+        if not self.motion or not len(self.buffer.clip_motion):
+            return None
+        return float(self.buffer.clip_motion.max())
 
-            while(len(clip) < clip_size and len(self.buffer)):
-                clip.append(self.buffer.popleft())
-
-
-        #loop clip if not enough frames
-        while len(clip) < clip_size:
-            clip.extend(clip[: clip_size - len(clip) ])
-
-        return clip
+    def clip_trace(self):
+        #capture times of the new frames of the last clip, stage entries are added as it moves on
+        overlap, available = self.new_frames()
+        return ClipTrace(self.buffer.seen - available + overlap, self.buffer.clip_stamps[overlap:available])
 
     def start_capture_thread(self):
         self.capture_thread.daemon = True
@@ -77,7 +149,9 @@ class VideoCapture():
     
     def stop(self):
         self.stop_flag.set()
+        self.buffer.close()
         self.end_capture_thread()
+        unbind_gauges(self.gauges)
 
     def isFlowing(self):
         return self.isPlaying() or len(self.buffer)